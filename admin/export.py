@@ -0,0 +1,124 @@
+# IMPORTS
+import csv
+import heapq
+import io
+import json
+import sys
+import zlib
+
+import click
+from cryptography.fernet import Fernet
+
+from app import app, db
+from lottery.archive import unpack_draws, unpack_ids
+from lottery.tickets import ticket_to_string
+from models import User, Draw, DrawArchive
+
+# CONFIG
+EXPORT_FORMATS = ('csv', 'ndjson')
+EXPORT_COLUMNS = ('draw_id', 'lottery_round', 'user_id', 'email', 'numbers', 'matches_master')
+
+
+# Yield every user draw of a lottery round decrypted with its owner's key and joined to the owner's email,
+# ordered by user and draw id, whether the draw is still in the draws table or has been archived
+def iter_round_draws(lottery_round, batch_size=1000):
+    return heapq.merge(iter_live_draws(lottery_round, batch_size), iter_archived_draws(lottery_round, batch_size),
+                       key=lambda row: (row[2], row[0] or 0))
+
+
+# The round's draws still in the draws table.
+# Rows are read through a server side cursor in batches of batch_size, so memory use does not grow with the round.
+def iter_live_draws(lottery_round, batch_size=1000):
+    query = db.session.query(Draw.id, Draw.lottery_round, Draw.user_id, User.email, Draw.numbers,
+                             Draw.matches_master, User.draws_key) \
+        .join(User, User.id == Draw.user_id) \
+        .filter(Draw.lottery_round == lottery_round, Draw.master_draw.is_(False)) \
+        .order_by(Draw.user_id, Draw.id) \
+        .execution_options(stream_results=True) \
+        .yield_per(batch_size)
+
+    # Rows are ordered by user, so each user's Fernet key is only built once
+    fernet_user_id, fernet = None, None
+    for draw_id, draw_round, user_id, email, numbers, matches_master, draws_key in query:
+        if user_id != fernet_user_id:
+            fernet_user_id, fernet = user_id, Fernet(draws_key)
+        yield draw_id, draw_round, user_id, email, fernet.decrypt(numbers).decode('utf-8'), matches_master
+
+
+# The round's draws moved to draws_archive (see lottery/archive.py), one archive row per user
+def iter_archived_draws(lottery_round, batch_size=1000):
+    query = db.session.query(DrawArchive.user_id, User.email, DrawArchive.draws, DrawArchive.draw_ids,
+                             User.draws_key) \
+        .join(User, User.id == DrawArchive.user_id) \
+        .filter(DrawArchive.lottery_round == lottery_round) \
+        .order_by(DrawArchive.user_id, DrawArchive.id) \
+        .execution_options(stream_results=True) \
+        .yield_per(batch_size)
+
+    for user_id, email, packed_draws, packed_ids, draws_key in query:
+        draws = unpack_draws(Fernet(draws_key).decrypt(packed_draws))
+        # Archives made before the draw ids were kept export without them
+        draw_ids = unpack_ids(packed_ids) if packed_ids else [None] * len(draws)
+        for draw_id, (numbers, matches_master) in zip(draw_ids, draws):
+            yield draw_id, lottery_round, user_id, email, ticket_to_string(numbers), matches_master
+
+
+# Encode the rows as chunks of CSV or newline delimited JSON, one chunk per batch_size rows
+def encode_rows(rows, export_format='csv', batch_size=1000):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    if export_format == 'csv':
+        writer.writerow(EXPORT_COLUMNS)
+
+    for count, row in enumerate(rows, 1):
+        if export_format == 'csv':
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n')
+
+        if count % batch_size == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+# Compress a stream of byte chunks into a single gzip stream
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+# Return the byte stream of an export of a lottery round
+def export_round(lottery_round, export_format='csv', compress=False, batch_size=1000):
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError('Export format must be one of %s' % ', '.join(EXPORT_FORMATS))
+
+    chunks = encode_rows(iter_round_draws(lottery_round, batch_size), export_format, batch_size)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+# Command line export for auditors, e.g. flask --app app export-draws 3 --format ndjson --gzip -o round3.ndjson.gz
+@app.cli.command('export-draws')
+@click.argument('lottery_round', type=int)
+@click.option('--format', 'export_format', type=click.Choice(EXPORT_FORMATS), default='csv')
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip.')
+@click.option('--batch-size', type=int, default=1000, help='Rows fetched and decrypted per batch.')
+@click.option('-o', '--output', type=click.Path(dir_okay=False, writable=True), help='Defaults to stdout.')
+def export_draws_command(lottery_round, export_format, compress, batch_size, output):
+    # SQLALCHEMY_ECHO logs every query to stdout, which would be mixed into the export when writing to stdout
+    db.engine.echo = False
+    stream = open(output, 'wb') if output else sys.stdout.buffer
+    try:
+        for chunk in export_round(lottery_round, export_format, compress, batch_size):
+            stream.write(chunk)
+    finally:
+        if output:
+            stream.close()
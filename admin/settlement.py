@@ -0,0 +1,74 @@
+# IMPORTS
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import update, select, func
+
+from app import db
+from lottery.scoring import score_draws, score_shard
+from lottery.ticket_index import ticket_index
+from models import Draw, TicketFingerprint, TicketCount
+from queries import unplayed_draws_statement, get_last_unplayed_draw_id
+
+
+# Score every unplayed user draw up to max_draw_id against the winning numbers.
+# Returns the winners as (draw id, numbers, user id, email) and the draws in each prize tier as {matches: draws}.
+# With shard_count > 1 the users are split by user_id % shard_count and each shard is scored by its own worker
+# process with its own database connection. Winners are returned ordered by draw id, so the result is the same
+# whatever the number of shards.
+def score_round(winning_numbers, max_draw_id, shard_count=1):
+    if shard_count <= 1:
+        return score_draws(db.session.execute(unplayed_draws_statement(max_draw_id)), winning_numbers)
+
+    database_url = db.engine.url.render_as_string(hide_password=False)
+    statements = [unplayed_draws_statement(max_draw_id, shard, shard_count) for shard in range(shard_count)]
+
+    # Workers are spawned rather than forked so they do not inherit the app's open database connections
+    with ProcessPoolExecutor(max_workers=shard_count, mp_context=multiprocessing.get_context('spawn')) as executor:
+        shards = list(executor.map(score_shard, [database_url] * shard_count, statements,
+                                   [winning_numbers] * shard_count))
+
+    # Merge the shards' results
+    winners = sorted(winner for shard_winners, _ in shards for winner in shard_winners)
+    tiers = sum((shard_tiers for _, shard_tiers in shards), Counter())
+    return winners, tiers
+
+
+# Play the round of the winning draw against every unplayed user draw.
+# Returns the winners as (lottery round, numbers, user id, email) and the draws in each prize tier,
+# or (None, None) if there are no user draws.
+def settle_round(winning_draw, shard_count=1):
+    # Draws submitted while the round is being played have higher ids and are left for the next round
+    max_draw_id = get_last_unplayed_draw_id()
+    if max_draw_id is None:
+        return None, None
+
+    winners, tiers = score_round(winning_draw.numbers, max_draw_id, shard_count)
+
+    # Update the current winning draw as played
+    db.session.execute(update(Draw).where(Draw.id == winning_draw.id).values(been_played=True))
+    # Update the winning user draws
+    db.session.execute(update(Draw).where(Draw.id.in_([draw_id for draw_id, _, _, _ in winners]))
+                       .values(matches_master=True))
+    # Update every draw that was scored as played in the current lottery round
+    db.session.execute(update(Draw)
+                       .where(Draw.master_draw.is_(False), Draw.been_played.is_(False), Draw.id <= max_draw_id)
+                       .values(been_played=True, lottery_round=winning_draw.lottery_round))
+    # Move their fingerprints to the played round, so the users can submit the same numbers again next round
+    db.session.execute(update(TicketFingerprint)
+                       .where(TicketFingerprint.lottery_round == 0, TicketFingerprint.draw_id <= max_draw_id)
+                       .values(lottery_round=winning_draw.lottery_round))
+    # Restart each user's quota count from the draws left in the open round, submitted while the round was played
+    db.session.execute(update(TicketCount)
+                       .values(tickets=select(func.count(TicketFingerprint.id))
+                               .where(TicketFingerprint.user_id == TicketCount.user_id,
+                                      TicketFingerprint.lottery_round == 0)
+                               .scalar_subquery())
+                       .execution_options(synchronize_session=False))
+
+    # Commit the played round to the database
+    db.session.commit()
+    ticket_index.rebuild()
+
+    return [(winning_draw.lottery_round, numbers, user_id, email) for _, numbers, user_id, email in winners], tiers
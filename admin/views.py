@@ -1,13 +1,14 @@
 # IMPORTS
-import random
-
-from sqlalchemy.orm import make_transient
-
 from users.forms import RegisterForm
-from flask import Blueprint, render_template, flash, redirect, url_for, session
+from flask import Blueprint, render_template, flash, redirect, url_for, session, request, Response, \
+    stream_with_context, abort, current_app
 from flask_login import current_user, login_required
 from app import db, requires_roles
-from models import User, Draw, decrypt
+from models import User, Draw
+from queries import get_winning_draw, get_registered_users, get_user_activity, get_daily_logins
+from admin.export import export_round, EXPORT_FORMATS
+from admin.settlement import settle_round
+from lottery.rng import lucky_dip
 
 # CONFIG
 admin_blueprint = Blueprint('admin', __name__, template_folder='templates')
@@ -27,38 +28,7 @@ def admin():
 @login_required
 @requires_roles('admin')
 def generate_winning_draw():
-    # Get current winning draw
-    current_winning_draw = Draw.query.filter_by(master_draw=True).first()
-    # Determines the lottery round
-    lottery_round = 1
-
-    # If a current winning draw exists
-    if current_winning_draw:
-        # Update lottery round by 1
-        lottery_round = current_winning_draw.lottery_round + 1
-
-        # Delete current winning draw from the database
-        db.session.delete(current_winning_draw)
-        db.session.commit()
-
-    # Generates six random numbers within the range given
-    winning_numbers = random.sample(range(1, 60), 6)
-    # Sorts the winning numbers
-    winning_numbers.sort()
-    # Creates a string representation of the winning numbers
-    winning_numbers_string = ''
-    # Appends each winning number to the string
-    for i in range(6):
-        winning_numbers_string += str(winning_numbers[i]) + ' '
-    winning_numbers_string = winning_numbers_string[:-1]
-
-    # Creates a new draw object for the current user
-    new_winning_draw = Draw(user_id=current_user.id, numbers=winning_numbers_string, master_draw=True,
-                            lottery_round=lottery_round, draws_key=current_user.draws_key)
-
-    # Adds the new winning draw to the database
-    db.session.add(new_winning_draw)
-    db.session.commit()
+    winning_numbers_string = create_winning_draw()
 
     # Displays message and then redirects to the admin page
     flash("New winning draw %s added." % winning_numbers_string)
@@ -70,14 +40,10 @@ def generate_winning_draw():
 @login_required
 @requires_roles('admin')
 def view_winning_draw():
-    # Get winning draw from the database
-    current_winning_draw = Draw.query.filter_by(master_draw=True, been_played=False).first()
+    current_winning_draw = get_winning_draw()
 
     # Check if a winning draw exists
     if current_winning_draw:
-        creator = User.query.filter_by(id=current_winning_draw.user_id).first()
-        make_transient(creator)
-        current_winning_draw.view_draws(creator.draws_key)
         # re-render admin page with current winning draw and lottery round
         return render_template('admin/admin.html', winning_draw=current_winning_draw, name=current_user.firstname)
 
@@ -91,65 +57,18 @@ def view_winning_draw():
 @login_required
 @requires_roles('admin')
 def run_lottery():
-    # Get the current unplayed winning draw
-    current_winning_draw = Draw.query.filter_by(master_draw=True, been_played=False).first()
-
-    # Check if current unplayed winning draw exists
-    if current_winning_draw:
-
-        # Get all the unplayed user draws
-        user_draws = Draw.query.filter_by(master_draw=False, been_played=False).all()
-        results = []  # List to store the winners information
-
-        # Check if at least one unplayed user draw exists
-        if user_draws:
-
-            # Update the current winning draw as played
-            current_winning_draw.been_played = True
-            db.session.add(current_winning_draw)
-            db.session.commit()
-
-            # Iterate through each unplayed user draw
-            for draw in user_draws:
-
-                # Get the corresponding user (instance/object)
-                user = User.query.filter_by(id=draw.user_id).first()
-
-                # if user draw matches current unplayed winning draw
-                if draw.numbers == current_winning_draw.numbers:
-                    # Update draw information using the creator's draw key
-                    creator = User.query.filter_by(id=current_winning_draw.user_id).first()
-                    make_transient(creator)
-                    draw.view_draws(creator.draws_key)
-                    # Add details of winner to list of results
-                    results.append((current_winning_draw.lottery_round, draw.numbers, draw.user_id, user.email))
-
-                    # Update the user draw as a winning draw
-                    draw.matches_master = True
+    results, message = run_current_round()
 
-                # Update the user draw as played
-                draw.been_played = True
-
-                # update draw with current lottery round
-                draw.lottery_round = current_winning_draw.lottery_round
-
-                # Commit draw changes to the database
-                db.session.add(draw)
-                db.session.commit()
-
-            # If there are no winners, display message
-            if len(results) == 0:
-                flash("No winners.")
-            # Redirect to admin page with the winner's information
-            return render_template('admin/admin.html', results=results, name=current_user.firstname)
-
-        # If there are no user draws entered, display message
-        flash("No user draws entered.")
-        return admin()
+    # If the round could not be played, display message and redirect to admin page
+    if results is None:
+        flash(message)
+        return redirect(url_for('admin.admin'))
 
-    # If current unplayed winning draw does not exist, display message and redirect to admin page
-    flash("Current winning draw expired. Add new winning draw for next round.")
-    return redirect(url_for('admin.admin'))
+    # If there are no winners, display message
+    if len(results) == 0:
+        flash("No winners.")
+    # Redirect to admin page with the winner's information
+    return render_template('admin/admin.html', results=results, name=current_user.firstname)
 
 
 # View all registered users
@@ -158,7 +77,7 @@ def run_lottery():
 @requires_roles('admin')
 def view_all_users():
     # Retrieve all registered users with the role pf 'user'
-    current_users = User.query.filter_by(role='user').all()
+    current_users = get_registered_users()
     # Render the admin template with the current user's name and the list of the users
     return render_template('admin/admin.html', name=current_user.firstname, current_users=current_users)
 
@@ -168,16 +87,30 @@ def view_all_users():
 @login_required
 @requires_roles('admin')
 def logs():
-    # Read the lottery.log file and retrieve the last 10 lines
-    with open("lottery.log", "r") as f:
-        content = f.read().splitlines()[-10:]
-
-        # Reverse the list to display the latest logs first
-        content.reverse()
+    content = read_security_logs()
     # Render the admin template with the current user's name and the reversed log entries
     return render_template('admin/admin.html', logs=content, name=current_user.firstname)
 
 
+# Stream every draw of a lottery round as CSV or newline delimited JSON, e.g. /export_draws/3?format=ndjson&gzip=1
+@admin_blueprint.route('/export_draws/<int:lottery_round>')
+@login_required
+@requires_roles('admin')
+def export_draws(lottery_round):
+    export_format = request.args.get('format', 'csv')
+    compress = request.args.get('gzip') == '1'
+
+    # Reject unknown formats
+    if export_format not in EXPORT_FORMATS:
+        abort(400)
+
+    filename = 'round_%d.%s%s' % (lottery_round, export_format, '.gz' if compress else '')
+    return Response(stream_with_context(export_round(lottery_round, export_format, compress)),
+                    mimetype='application/gzip' if compress else
+                    ('text/csv' if export_format == 'csv' else 'application/x-ndjson'),
+                    headers={'Content-Disposition': 'attachment; filename=%s' % filename})
+
+
 @admin_blueprint.route('/registerAdmin', methods=['GET', 'POST'])
 def register_admin():
     # Create a new instance of the 'RegisterForm' class for user registration
@@ -219,7 +152,75 @@ def register_admin():
 @login_required
 @requires_roles('admin')
 def view_user_activity():
-    # Retrieve all registered users with the role of 'user'
-    current_users = User.query.filter_by(role='user').all()
-    # Render the admin template with the current user's name and list of all the users
-    return render_template('admin/admin.html', name=current_user.firstname, view_current_users=current_users)
+    page = request.args.get('page', 1, type=int)
+    # Retrieve one page of the login activity of registered users with the role of 'user', and the logins per day
+    current_users, has_next = get_user_activity(page)
+    # Render the admin template with the current user's name and the page of users
+    return render_template('admin/admin.html', name=current_user.firstname, view_current_users=current_users,
+                           activity_page=page, activity_has_next=has_next, daily_logins=get_daily_logins())
+
+
+# HELPERS
+# The operations behind each admin button, shared by the views above and the JSON API (api/views.py)
+
+# Replace the current winning draw with a new one for the next round and return its numbers
+def create_winning_draw():
+    # Get current winning draw
+    current_winning_draw = Draw.query.filter_by(master_draw=True).first()
+    # Determines the lottery round
+    lottery_round = 1
+
+    # If a current winning draw exists
+    if current_winning_draw:
+        # Update lottery round by 1
+        lottery_round = current_winning_draw.lottery_round + 1
+
+        # Delete current winning draw from the database
+        db.session.delete(current_winning_draw)
+        db.session.commit()
+
+    # Generates six unique random numbers between 1 and 60 in ascending order
+    winning_numbers = lucky_dip()
+    # Creates a string representation of the winning numbers
+    winning_numbers_string = ' '.join(str(number) for number in winning_numbers)
+
+    # Creates a new draw object for the current user
+    new_winning_draw = Draw(user_id=current_user.id, numbers=winning_numbers_string, master_draw=True,
+                            lottery_round=lottery_round, draws_key=current_user.draws_key)
+
+    # Adds the new winning draw to the database
+    db.session.add(new_winning_draw)
+    db.session.commit()
+
+    return winning_numbers_string
+
+
+# Play the current round against every unplayed user draw.
+# Returns (results, None) when the round was played or (None, message) when it could not be.
+def run_current_round():
+    # Get the current unplayed winning draw
+    current_winning_draw = get_winning_draw()
+
+    # Check if current unplayed winning draw exists
+    if not current_winning_draw:
+        return None, "Current winning draw expired. Add new winning draw for next round."
+
+    # Play the round, split across worker processes when SETTLEMENT_SHARDS is above 1
+    results, _ = settle_round(current_winning_draw, current_app.config['SETTLEMENT_SHARDS'])
+
+    # Check if at least one unplayed user draw exists
+    if results is None:
+        return None, "No user draws entered."
+
+    return results, None
+
+
+# Return the last 10 security log entries, latest first
+def read_security_logs():
+    # Read the lottery.log file and retrieve the last 10 lines
+    with open("lottery.log", "r") as f:
+        content = f.read().splitlines()[-10:]
+
+    # Reverse the list to display the latest logs first
+    content.reverse()
+    return content
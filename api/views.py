@@ -0,0 +1,179 @@
+# IMPORTS
+from flask import Blueprint, jsonify, request
+from flask_login import current_user, login_required
+
+from admin.views import create_winning_draw, run_current_round, read_security_logs
+from app import requires_roles
+from async_db import async_version
+from lottery.archive import user_history
+from lottery.rng import lucky_dips
+from lottery.tickets import validate_tickets, TicketError
+from lottery.views import submit_draws, get_playable_draws, get_played_draws, get_playable_draws_async, \
+    get_played_draws_async, archive_played_draws
+from queries import get_winning_draw, get_registered_users, get_user_activity, get_daily_logins, view_to_dict
+
+# CONFIG
+# Most Lucky Dips or tickets that can be requested or submitted in one call
+MAX_BATCH_SIZE = 10000
+
+# JSON versions of the admin and lottery page buttons, so a page can fetch and update only the affected section
+api_blueprint = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+# ERRORS
+# Errors in the API are returned as JSON rather than the HTML error pages, so a page can show them in place.
+# A request that is not logged in gets a 401, as app.py sets no login view for this blueprint
+def api_error(error):
+    response = jsonify(error=error.description)
+    response.status_code = error.code
+    # Keep headers such as Retry-After on shed requests
+    for name, value in error.get_headers():
+        if name.lower() != 'content-type':
+            response.headers[name] = value
+    return response
+
+
+# Registered for each code, as the app's handlers for these codes would otherwise take precedence
+for error_code in (400, 401, 403, 404, 500, 503):
+    api_blueprint.register_error_handler(error_code, api_error)
+
+
+# ADMIN
+@api_blueprint.route('/admin/winning_draw', methods=['GET'])
+@login_required
+@requires_roles('admin')
+def winning_draw():
+    current_winning_draw = get_winning_draw()
+
+    # If no winning draw exists, return an error message
+    if not current_winning_draw:
+        return jsonify(error="No valid winning draw exists. Please add new winning draw."), 404
+
+    return jsonify(winning_draw=view_to_dict(current_winning_draw))
+
+
+@api_blueprint.route('/admin/winning_draw', methods=['POST'])
+@login_required
+@requires_roles('admin')
+def generate_winning_draw():
+    winning_numbers_string = create_winning_draw()
+    return jsonify(message="New winning draw %s added." % winning_numbers_string), 201
+
+
+@api_blueprint.route('/admin/run_lottery', methods=['POST'])
+@login_required
+@requires_roles('admin')
+def run_lottery():
+    results, message = run_current_round()
+
+    # If the round could not be played, return the reason
+    if results is None:
+        return jsonify(error=message), 409
+
+    return jsonify(results=[{'lottery_round': lottery_round, 'numbers': numbers, 'user_id': user_id, 'email': email}
+                            for lottery_round, numbers, user_id, email in results])
+
+
+@api_blueprint.route('/admin/users')
+@login_required
+@requires_roles('admin')
+def view_all_users():
+    return jsonify(users=[view_to_dict(user) for user in get_registered_users()])
+
+
+@api_blueprint.route('/admin/logs')
+@login_required
+@requires_roles('admin')
+def logs():
+    return jsonify(logs=read_security_logs())
+
+
+@api_blueprint.route('/admin/user_activity')
+@login_required
+@requires_roles('admin')
+def view_user_activity():
+    page = request.args.get('page', 1, type=int)
+    users, has_next = get_user_activity(page)
+    return jsonify(users=[view_to_dict(user) for user in users], page=page, has_next=has_next,
+                   daily_logins=[view_to_dict(day) for day in get_daily_logins()])
+
+
+# LOTTERY
+async def view_draws_async():
+    return jsonify(draws=[view_to_dict(draw) for draw in await get_playable_draws_async()])
+
+
+@api_blueprint.route('/lottery/draws', methods=['GET'])
+@login_required
+@requires_roles('user')
+@async_version(view_draws_async)
+def view_draws():
+    return jsonify(draws=[view_to_dict(draw) for draw in get_playable_draws()])
+
+
+# Submit one draw {"numbers": [..]} or a batch {"tickets": [[..], ..]}.
+# A batch is only stored if every ticket in it is valid.
+@api_blueprint.route('/lottery/draws', methods=['POST'])
+@login_required
+@requires_roles('user')
+def create_draw():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        body = {}
+    tickets = body['tickets'] if 'tickets' in body else [body.get('numbers')]
+
+    if not isinstance(tickets, list) or not 1 <= len(tickets) <= MAX_BATCH_SIZE:
+        return jsonify(error='Tickets must be a list of between 1 and %d draws' % MAX_BATCH_SIZE), 400
+
+    valid, errors = validate_tickets(tickets)
+    if errors:
+        return jsonify(errors=[{'index': index, 'error': message} for index, message in errors]), 400
+
+    try:
+        submitted = submit_draws(valid)
+    except TicketError as error:
+        return jsonify(error=str(error)), 409
+
+    return jsonify(message='%d draw(s) submitted.' % len(submitted), draws=submitted), 201
+
+
+# Generate ?count= Lucky Dips (default 1) on the server for single or batch submissions
+@api_blueprint.route('/lottery/lucky_dip')
+@login_required
+@requires_roles('user')
+def lucky_dip():
+    count = request.args.get('count', 1, type=int)
+
+    if not 1 <= count <= MAX_BATCH_SIZE:
+        return jsonify(error='Count must be between 1 and %d' % MAX_BATCH_SIZE), 400
+
+    return jsonify(draws=lucky_dips(count))
+
+
+async def check_draws_async():
+    return jsonify(results=[view_to_dict(draw) for draw in await get_played_draws_async()])
+
+
+@api_blueprint.route('/lottery/results')
+@login_required
+@requires_roles('user')
+@async_version(check_draws_async)
+def check_draws():
+    return jsonify(results=[view_to_dict(draw) for draw in get_played_draws()])
+
+
+@api_blueprint.route('/lottery/play_again', methods=['POST'])
+@login_required
+@requires_roles('user')
+def play_again():
+    archived = archive_played_draws()
+    return jsonify(message="All played draws archived.", archived=archived)
+
+
+# Draws of earlier rounds, read from the archive
+@api_blueprint.route('/lottery/history')
+@login_required
+@requires_roles('user')
+def history():
+    return jsonify(history=[{'lottery_round': lottery_round, 'numbers': numbers, 'matches_master': matches_master}
+                            for lottery_round, numbers, matches_master in user_history(current_user)])
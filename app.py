@@ -1,15 +1,20 @@
 # IMPORTS
+import atexit
 import logging
 import os
 from functools import wraps
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 
 from flask_talisman import Talisman
 from flask_qrcode import QRcode
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, current_app, abort
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, current_user
 from werkzeug.datastructures import csp
 
+from permissions import AnonymousUser, required_masks, is_authorised
+
 
 class SecurityFilter(logging.Filter):
     def filter(self, record):
@@ -24,7 +29,15 @@ file_handler.setLevel(logging.WARNING)
 file_handler.addFilter(SecurityFilter())
 formatter = logging.Formatter('%(asctime)s : %(message)s', '%d/%m/%Y %I:%M:%S %p')
 file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+
+# Requests only put log records on a queue, a background thread writes them to lottery.log
+log_queue = SimpleQueue()
+queue_handler = QueueHandler(log_queue)
+queue_handler.setLevel(logging.WARNING)
+logger.addHandler(queue_handler)
+log_listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
 
 # CONFIG
 app = Flask(__name__)
@@ -34,6 +47,16 @@ app.config['SQLALCHEMY_ECHO'] = os.getenv('SQLALCHEMY_ECHO')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = os.getenv('SQLALCHEMY_TRACK_MODIFICATIONS')
 app.config['RECAPTCHA_PUBLIC_KEY'] = os.getenv('RECAPTCHA_PUBLIC_KEY')
 app.config['RECAPTCHA_PRIVATE_KEY'] = os.getenv('RECAPTCHA_PRIVATE_KEY')
+# Number of worker processes a lottery round is settled across (1 = settle in the web process)
+app.config['SETTLEMENT_SHARDS'] = int(os.getenv('SETTLEMENT_SHARDS', 1))
+# Most draws a user can submit for one lottery round
+app.config['MAX_TICKETS_PER_ROUND'] = int(os.getenv('MAX_TICKETS_PER_ROUND', 100))
+# Serve the draw listings with async views querying the async engine in async_db.py (1) or with synchronous views
+# querying the app's own session (0). Off unless served over ASGI, where asgi.py turns it on
+app.config['ASYNC_DATABASE'] = os.getenv('ASYNC_DATABASE', '0') == '1'
+# Requests handled at once by one process, and moving average query time, above which requests get a 503 (0 = off)
+app.config['MAX_IN_FLIGHT_REQUESTS'] = int(os.getenv('MAX_IN_FLIGHT_REQUESTS', 100))
+app.config['DB_LATENCY_LIMIT_MS'] = int(os.getenv('DB_LATENCY_LIMIT_MS', 500))
 
 # Task 9 code to generate the security headers however, I believe they wouldn't function unless I did the HTTPS
 # csp = {'default-src': ['\'self\'', 'https://cdnjs.cloudflare.com/ajax/libs/bulma/0.7.2/css/bulma.min.css'],
@@ -54,18 +77,22 @@ def index():
 
 
 def requires_roles(*roles):
+    # The permissions each role needs are resolved once, when the view is decorated
+    masks = required_masks(roles)
+
     def wrapper(f):
         @wraps(f)
         def wrapped(*args, **kwargs):
-            if current_user.role not in roles:
+            if not is_authorised(current_user.permissions, masks):
                 logging.warning('SECURITY - Unauthorised log in attempt [%s, %s, %s, %s]',
-                                current_user.id,
-                                current_user.email,
+                                current_user.get_id(),
+                                getattr(current_user, 'email', None),
                                 request.remote_addr,
                                 current_user.role
                                 )
-                return render_template('403.html')
-            return f(*args, **kwargs)
+                abort(403)
+            # ensure_sync lets the decorator wrap async views as well
+            return current_app.ensure_sync(f)(*args, **kwargs)
         return wrapped
     return wrapper
 
@@ -75,48 +102,38 @@ def requires_roles(*roles):
 from users.views import users_blueprint
 from admin.views import admin_blueprint
 from lottery.views import lottery_blueprint
+from api.views import api_blueprint
 
 #
 # # register blueprints with app
 app.register_blueprint(users_blueprint)
 app.register_blueprint(admin_blueprint)
 app.register_blueprint(lottery_blueprint)
+app.register_blueprint(api_blueprint)
 
 login_manager = LoginManager()
 login_manager.login_view = 'users.login'
+# The JSON API answers requests that are not logged in with a 401 instead of redirecting to the login page
+login_manager.blueprint_login_views = {'api': None}
+login_manager.anonymous_user = AnonymousUser
 login_manager.init_app(app)
 
 from models import User
 
+# COMMAND LINE TOOLS
+# import modules defining flask commands so they are registered with the app
+import users.bulk_import
+import users.activity
+
 
 @login_manager.user_loader
 def load_user(id):
     return User.query.get(int(id))
 
 
-@app.errorhandler(400)
-def bad_request_error(error):
-    return render_template('400.html'), 400
-
-
-@app.errorhandler(403)
-def forbidden_error(error):
-    return render_template('403.html'), 403
-
-
-@app.errorhandler(404)
-def not_found_error(error):
-    return render_template('404.html'), 404
-
-
-@app.errorhandler(500)
-def internal_server_error(error):
-    return render_template('500.html'), 500
-
-
-@app.errorhandler(503)
-def service_unavailable_error(error):
-    return render_template('503.html'), 503
+# ERROR PAGES
+# import after the blueprints are registered, as the error pages are rendered when the module is imported
+import errors
 
 
 if __name__ == "__main__":
@@ -0,0 +1,23 @@
+# ASGI entry point for serving the app with an ASGI server, e.g.
+# uvicorn asgi:asgi_app --workers 4
+# Served this way ASYNC_DATABASE defaults to on, so the draw listings (lottery.view_draws, lottery.check_draws and
+# their JSON API versions) are async views waiting on the async database engine in async_db.py. Under a WSGI server
+# they stay synchronous. Compare connections handled per worker against the synchronous deployment (app.run()) with:
+# python benchmarks.py serving
+#
+# This does not make the app natively async. WsgiToAsgi runs every request on a thread from its thread pool, and
+# Flask runs each async view on an event loop inside that thread, so a waiting request still holds a thread.
+# The async engine uses NullPool, so each request also opens a new database connection (a new thread with aiosqlite).
+# Set ASYNC_DATABASE=0 to serve the synchronous views over ASGI instead.
+
+# IMPORTS
+import os
+
+from asgiref.wsgi import WsgiToAsgi
+
+# Must be set before the app reads its config
+os.environ.setdefault('ASYNC_DATABASE', '1')
+
+from app import app
+
+asgi_app = WsgiToAsgi(app)
@@ -0,0 +1,57 @@
+# Async database access for views that mostly wait on the database, used when ASYNC_DATABASE is on (the default
+# when served over ASGI, see asgi.py). Flask runs `async def` views on an event loop, where queries go through an
+# async SQLAlchemy engine (aiosqlite for the local SQLite database) and CPU heavy work such as bcrypt and Fernet runs
+# on a thread pool.
+
+# IMPORTS
+import asyncio
+from functools import partial
+
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.pool import NullPool
+
+from app import app, db
+
+# CONFIG
+# Async driver used in place of each synchronous database driver
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite',
+                 'postgresql': 'postgresql+asyncpg',
+                 'mysql': 'mysql+aiomysql'}
+
+async_engine = None
+
+
+# Return the async engine, created on first use from the URL of the app's synchronous engine
+def get_async_engine():
+    global async_engine
+    if async_engine is None:
+        url = db.engine.url
+        # Flask runs each async view on its own event loop, so connections cannot be pooled between requests.
+        # Every request therefore pays for a new connection (and for aiosqlite, a new thread)
+        async_engine = create_async_engine(url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(),
+                                                                                url.drivername)),
+                                           poolclass=NullPool)
+    return async_engine
+
+
+# Execute a select statement and return all of its rows
+async def fetch_all(statement):
+    async with AsyncSession(get_async_engine()) as session:
+        return (await session.execute(statement)).all()
+
+
+# Run a blocking function on the default thread pool so it does not hold up the event loop
+async def run_in_executor(function, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(None, partial(function, *args, **kwargs))
+
+
+# Register async_view in place of the decorated synchronous view when ASYNC_DATABASE is on.
+# Under a WSGI server every async view pays for its own event loop, so the synchronous view is kept by default
+def async_version(async_view):
+    def wrapper(view):
+        if not app.config['ASYNC_DATABASE']:
+            return view
+        # Keep the synchronous view's name, which is its endpoint
+        async_view.__name__ = view.__name__
+        return async_view
+    return wrapper
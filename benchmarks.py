@@ -0,0 +1,236 @@
+# Benchmarks and statistical checks for the lottery application.
+# Run with: python benchmarks.py <benchmark> [options], e.g. python benchmarks.py rng --tickets 100000
+
+# IMPORTS
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+
+# CONFIG
+# Chi-squared critical value for 59 degrees of freedom (60 numbers) at a 0.001 significance level
+CHI_SQUARED_CRITICAL_59 = 98.324
+
+
+# Generate quick-pick tickets, report throughput and check every number 1-60 is drawn equally often
+def benchmark_rng(args):
+    from lottery.rng import lucky_dips, NUMBER_RANGE, NUMBERS_PER_DRAW, LOWEST_NUMBER, HIGHEST_NUMBER
+
+    start = time.perf_counter()
+    tickets = []
+    remaining = args.tickets
+    while remaining > 0:
+        tickets.extend(lucky_dips(min(args.batch, remaining)))
+        remaining -= args.batch
+    elapsed = time.perf_counter() - start
+
+    print('Generated %d tickets in %.3fs (%.0f tickets/s)' % (len(tickets), elapsed, len(tickets) / elapsed))
+
+    # Every ticket must hold six unique, sorted numbers within the range
+    for ticket in tickets:
+        assert len(set(ticket)) == NUMBERS_PER_DRAW, ticket
+        assert ticket == sorted(ticket), ticket
+        assert LOWEST_NUMBER <= ticket[0] and ticket[-1] <= HIGHEST_NUMBER, ticket
+
+    counts = Counter(number for ticket in tickets for number in ticket)
+    expected = len(tickets) * NUMBERS_PER_DRAW / NUMBER_RANGE
+    chi_squared = sum((counts[number] - expected) ** 2 / expected
+                      for number in range(LOWEST_NUMBER, HIGHEST_NUMBER + 1))
+
+    print('Chi-squared = %.2f (critical value %.2f)' % (chi_squared, CHI_SQUARED_CRITICAL_59))
+    print('Numbers drawn: %d of %d, least/most frequent: %d/%d (expected %.0f)'
+          % (len(counts), NUMBER_RANGE, min(counts.values()), max(counts.values()), expected))
+    return chi_squared < CHI_SQUARED_CRITICAL_59
+
+
+# Validate an import of tickets with the plain ticket validator and with the WTForms DrawForm
+def benchmark_tickets(args):
+    from werkzeug.datastructures import MultiDict
+
+    from app import app
+    from lottery.forms import DrawForm
+    from lottery.rng import lucky_dips
+    from lottery.tickets import validate_tickets
+
+    # Reverse the numbers of each ticket so the validators also have to sort them
+    tickets = [ticket[::-1] for ticket in lucky_dips(args.tickets)]
+
+    start = time.perf_counter()
+    valid, errors = validate_tickets(tickets)
+    validator_time = time.perf_counter() - start
+
+    form_data = [MultiDict(('number%d' % (i + 1), number) for i, number in enumerate(ticket)) for ticket in tickets]
+    start = time.perf_counter()
+    with app.test_request_context():
+        forms = [DrawForm(formdata=data, meta={'csrf': False}) for data in form_data]
+        forms_valid = [form.numbers for form in forms if form.validate()]
+    form_time = time.perf_counter() - start
+
+    print('validate_tickets: %d tickets in %.3fs (%.0f tickets/s)' % (len(valid), validator_time,
+                                                                      len(tickets) / validator_time))
+    print('DrawForm:         %d tickets in %.3fs (%.0f tickets/s)' % (len(forms_valid), form_time,
+                                                                      len(tickets) / form_time))
+    print('Speed up: %.1fx' % (form_time / validator_time))
+    return not errors and valid == forms_valid
+
+
+# Start a server and wait until it accepts connections
+def start_server(command, port, timeout=30, env=None):
+    server = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              env=dict(os.environ, **(env or {})),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError('Server %s did not start' % ' '.join(command))
+
+
+# Send requests to url from concurrency threads at once, returns (latencies of successful requests, errors)
+def load(url, method, cookie, requests, concurrency):
+    from concurrent.futures import ThreadPoolExecutor
+
+    def send(_):
+        request = urllib.request.Request(url, method=method, data=b'' if method == 'POST' else None,
+                                         headers={'Cookie': 'session=' + cookie})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+            return time.perf_counter() - start
+        except (urllib.error.URLError, OSError):
+            return None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(requests)))
+    return [latency for latency in results if latency is not None], results.count(None)
+
+
+# Serving deployments compared by benchmark_serving, each a single worker process: the current synchronous deployment
+# (app.run(), Werkzeug's threaded server started here through flask run to choose the port) against uvicorn with
+# the async views (asgi.py). Load shedding is turned off so it does not cap the connections either can handle
+DEPLOYMENTS = {'sync (app.run)': (['-m', 'flask', '--app', 'app', 'run'], {'ASYNC_DATABASE': '0'}),
+               'async (uvicorn)': (['-m', 'uvicorn', 'asgi:asgi_app', '--workers', '1', '--log-level', 'warning'],
+                                   {'ASYNC_DATABASE': '1'})}
+SERVING_ENV = {'MAX_IN_FLIGHT_REQUESTS': '0', 'DB_LATENCY_LIMIT_MS': '0', 'FLASK_SKIP_DOTENV': '1'}
+
+
+# Measure how many concurrent connections one worker of each deployment handles. Each deployment is loaded at every
+# concurrency level, and handles a level if every request succeeds with a 95th percentile latency within
+# --max-p95-ms. Uses the database configured by SQLALCHEMY_DATABASE_URI.
+def benchmark_serving(args):
+    from app import app
+
+    # Sign a session cookie for the user, as Flask-Login does after logging in
+    cookie = app.session_interface.get_signing_serializer(app).dumps({'_user_id': str(args.user_id),
+                                                                      '_fresh': True})
+
+    passed = True
+    for name, (command, env) in DEPLOYMENTS.items():
+        server = start_server([sys.executable] + command + ['--port', str(args.port)], args.port,
+                              env=dict(SERVING_ENV, **env))
+        handled = 0
+        try:
+            for concurrency in args.concurrency:
+                requests = max(args.requests, concurrency)
+                start = time.perf_counter()
+                latencies, errors = load('http://127.0.0.1:%d%s' % (args.port, args.path), args.method, cookie,
+                                         requests, concurrency)
+                elapsed = time.perf_counter() - start
+
+                if not latencies:
+                    print('%s: %d concurrent, all %d requests failed' % (name, concurrency, errors))
+                    break
+                latencies.sort()
+                p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+                print('%s: %d concurrent, %d requests, %.0f requests/s, median %.1fms, p95 %.1fms, %d errors'
+                      % (name, concurrency, requests, requests / elapsed, statistics.median(latencies) * 1000, p95,
+                         errors))
+                if errors or p95 > args.max_p95_ms:
+                    break
+                handled = concurrency
+        finally:
+            server.terminate()
+            server.wait()
+
+        print('%s: handled %d concurrent connections per worker' % (name, handled))
+        # Both deployments must at least handle the lowest level
+        passed = passed and handled > 0
+    return passed
+
+
+# Settle the same seeded round unsharded and across each number of shards, and check the winners are identical
+def benchmark_settlement(args):
+    from simulate import use_scratch_database, seed_round
+
+    use_scratch_database()
+    from app import app, db
+    from admin.settlement import score_round
+    from queries import get_last_unplayed_draw_id
+
+    with app.app_context():
+        db.create_all()
+        winning_numbers = seed_round(args.users, args.draws, seed=args.seed, winner_every=args.winner_every)
+        max_draw_id = get_last_unplayed_draw_id()
+
+        results = {}
+        for shard_count in [1] + args.shards:
+            start = time.perf_counter()
+            results[shard_count] = score_round(winning_numbers, max_draw_id, shard_count)
+            print('%d shard(s): %d draws scored in %.3fs, %d winners'
+                  % (shard_count, args.draws, time.perf_counter() - start, len(results[shard_count][0])))
+
+    # Every shard count must find the same winners and the same prize tiers
+    expected_winners = len(range(0, args.draws, args.winner_every))
+    return all(result == results[1] for result in results.values()) and \
+        len(results[1][0]) >= expected_winners and sum(results[1][1].values()) == args.draws
+
+
+BENCHMARKS = {'rng': benchmark_rng,
+              'tickets': benchmark_tickets,
+              'serving': benchmark_serving,
+              'settlement': benchmark_settlement}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Lottery application benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    rng_parser = subparsers.add_parser('rng', help='Lucky Dip throughput and uniformity')
+    rng_parser.add_argument('--tickets', type=int, default=100000)
+    rng_parser.add_argument('--batch', type=int, default=1000, help='Tickets generated per call')
+
+    tickets_parser = subparsers.add_parser('tickets', help='Ticket validator against the WTForms DrawForm')
+    tickets_parser.add_argument('--tickets', type=int, default=10000)
+
+    serving_parser = subparsers.add_parser('serving', help='Concurrent connections per worker, sync against async')
+    serving_parser.add_argument('--user-id', type=int, required=True, help='User the requests are sent as')
+    serving_parser.add_argument('--path', default='/check_draws')
+    serving_parser.add_argument('--method', default='POST')
+    serving_parser.add_argument('--requests', type=int, default=1000, help='Requests sent at each level')
+    serving_parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 100, 200, 500],
+                                help='Concurrency levels, in increasing order')
+    serving_parser.add_argument('--max-p95-ms', type=float, default=1000)
+    serving_parser.add_argument('--port', type=int, default=5050)
+
+    settlement_parser = subparsers.add_parser('settlement', help='Sharded against unsharded settlement')
+    settlement_parser.add_argument('--users', type=int, default=1000)
+    settlement_parser.add_argument('--draws', type=int, default=50000)
+    settlement_parser.add_argument('--winner-every', type=int, default=1000)
+    settlement_parser.add_argument('--shards', type=int, nargs='+', default=[2, 4])
+    settlement_parser.add_argument('--seed', type=int, default=2031)
+
+    arguments = parser.parse_args()
+    passed = BENCHMARKS[arguments.benchmark](arguments)
+    print('PASSED' if passed else 'FAILED')
+    raise SystemExit(0 if passed else 1)
@@ -0,0 +1,155 @@
+# IMPORTS
+import hashlib
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+from flask import render_template, request, g, Response, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.exceptions import ServiceUnavailable
+
+from app import app
+from permissions import ROLE_PERMISSIONS, AnonymousUser
+
+# CONFIG
+ERROR_CODES = (400, 403, 404, 500, 503)
+# Seconds a client is asked to wait before retrying a shed request
+RETRY_AFTER = 5
+# Database latency is the 90th percentile query time of requests over the last LATENCY_WINDOW seconds, and only
+# sheds requests once there are at least LATENCY_MIN_SAMPLES queries, so a single slow query never trips it
+LATENCY_PERCENTILE = 0.9
+LATENCY_WINDOW = 10
+LATENCY_MIN_SAMPLES = 50
+LATENCY_MAX_SAMPLES = 5000
+# Seconds the percentile is reused for before it is computed again
+LATENCY_RECHECK = 0.5
+# Admin bulk operations whose long queries are expected, so they are neither timed nor shed
+BULK_ENDPOINTS = {'admin.run_lottery', 'api.run_lottery', 'admin.export_draws', 'lottery.play_again',
+                  'api.play_again'}
+
+
+# ERROR PAGES
+# Every error page is rendered once at startup, for each version of the navigation bar (anonymous, then each role),
+# and served from memory, so errors cost no template rendering however many of them there are.
+# Returns {(code, role): (body, etag)}
+def render_error_pages():
+    principals = [AnonymousUser()] + [SimpleNamespace(is_anonymous=False, is_authenticated=True, role=role)
+                                      for role in ROLE_PERMISSIONS]
+    pages = {}
+    with app.test_request_context():
+        for code in ERROR_CODES:
+            for principal in principals:
+                body = render_template('%d.html' % code, current_user=principal).encode('utf-8')
+                pages[(code, principal.role)] = (body, hashlib.sha1(body).hexdigest())
+    return pages
+
+
+def error_page(error):
+    # Only use the user if it has already been loaded for this request, so an error never adds a database query
+    principal = g.get('_login_user')
+    role = None if principal is None or principal.is_anonymous else principal.role
+    body, etag = error_pages.get((error.code, role)) or error_pages[(error.code, None)]
+
+    # If-None-Match is ignored, as preconditions do not apply to error responses (RFC 7232 section 5)
+    headers = {'ETag': '"%s"' % etag, 'Cache-Control': 'no-cache'}
+    if error.code == 503:
+        headers['Retry-After'] = str(RETRY_AFTER)
+    return Response(body, error.code, headers=headers, mimetype='text/html')
+
+
+error_pages = render_error_pages()
+for error_code in ERROR_CODES:
+    app.register_error_handler(error_code, error_page)
+
+
+# LOAD SHEDDING
+# Tracks the requests being handled by this process and the recent query times of requests.
+# When either crosses its limit new requests get the cached 503 page at once, instead of queueing behind
+# requests that are already slow and making the overload worse.
+class LoadMonitor:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.query_times = deque(maxlen=LATENCY_MAX_SAMPLES)  # (finished at, seconds), oldest first
+        self.latency = 0.0
+        self.latency_checked = 0.0
+
+    def request_started(self):
+        with self.lock:
+            self.in_flight += 1
+            return self.in_flight
+
+    def request_finished(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def record_query(self, seconds):
+        with self.lock:
+            self.query_times.append((time.monotonic(), seconds))
+
+    # True if the database is slow. Shed requests run no queries, so the samples age out of the window and
+    # requests are let through again to measure the database afresh
+    def database_overloaded(self, limit):
+        with self.lock:
+            now = time.monotonic()
+            while self.query_times and now - self.query_times[0][0] > LATENCY_WINDOW:
+                self.query_times.popleft()
+            if len(self.query_times) < LATENCY_MIN_SAMPLES:
+                return False
+
+            if now - self.latency_checked > LATENCY_RECHECK:
+                times = sorted(seconds for _, seconds in self.query_times)
+                self.latency = times[int(len(times) * LATENCY_PERCENTILE)]
+                self.latency_checked = now
+            return self.latency > limit
+
+
+load_monitor = LoadMonitor()
+
+
+# Only queries run by requests outside BULK_ENDPOINTS are timed
+def timing_queries():
+    return has_request_context() and g.get('time_queries', False)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['query_start_time'].pop()
+    if timing_queries():
+        load_monitor.record_query(seconds)
+
+
+# A failed query never reaches after_cursor_execute, so its start time is dropped here
+@event.listens_for(Engine, 'handle_error')
+def drop_query_timer(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_start_time'):
+        connection.info['query_start_time'].pop()
+
+
+@app.before_request
+def shed_load():
+    g.load_counted = True
+    in_flight = load_monitor.request_started()
+    if request.endpoint in BULK_ENDPOINTS:
+        return
+    g.time_queries = True
+
+    max_in_flight = app.config['MAX_IN_FLIGHT_REQUESTS']
+    latency_limit = app.config['DB_LATENCY_LIMIT_MS'] / 1000
+    if max_in_flight and in_flight > max_in_flight or \
+            latency_limit and load_monitor.database_overloaded(latency_limit):
+        raise ServiceUnavailable(retry_after=RETRY_AFTER)
+
+
+@app.teardown_request
+def request_done(exception):
+    if g.pop('load_counted', False):
+        load_monitor.request_finished()
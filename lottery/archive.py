@@ -0,0 +1,138 @@
+# IMPORTS
+import struct
+
+import click
+from cryptography.fernet import Fernet
+from sqlalchemy import func, update
+
+from app import app, db
+from lottery.rng import LOWEST_NUMBER, HIGHEST_NUMBER
+from lottery.tickets import ticket_to_string
+from models import User, Draw, DrawArchive, TicketFingerprint
+
+
+# PACKING
+# An archived draw is stored as one 64 bit integer: bit n is set for each number n (1-60) in the draw and
+# bit 0 is set if the draw matched the master draw. Six numbers take 8 bytes instead of a 100 byte Fernet token.
+def pack_draws(draws):
+    masks = []
+    for numbers, matches_master in draws:
+        mask = int(matches_master)
+        for number in numbers:
+            mask |= 1 << number
+        masks.append(mask)
+    return struct.pack('<%dQ' % len(masks), *masks)
+
+
+# Reverse of pack_draws, returns a list of (numbers, matches_master)
+def unpack_draws(packed):
+    draws = []
+    for mask, in struct.iter_unpack('<Q', packed):
+        numbers = [number for number in range(LOWEST_NUMBER, HIGHEST_NUMBER + 1) if mask >> number & 1]
+        draws.append((numbers, bool(mask & 1)))
+    return draws
+
+
+# Pack and unpack the ids of archived draws as 8 byte integers
+def pack_ids(draw_ids):
+    return struct.pack('<%dQ' % len(draw_ids), *draw_ids)
+
+
+def unpack_ids(packed):
+    return [draw_id for draw_id, in struct.iter_unpack('<Q', packed)]
+
+
+# ARCHIVING
+# Move played user draws out of the draws table into draws_archive, one archive row per user per round.
+# Optionally limited to one user or to rounds up to max_round. Commits every batch_size archive rows.
+# Returns the number of draws archived.
+def archive_draws(user_id=None, max_round=None, batch_size=500):
+    played = [Draw.been_played.is_(True), Draw.master_draw.is_(False)]
+    if user_id is not None:
+        played.append(Draw.user_id == user_id)
+    if max_round is not None:
+        played.append(Draw.lottery_round <= max_round)
+
+    groups = db.session.query(Draw.lottery_round, Draw.user_id, User.draws_key) \
+        .join(User, User.id == Draw.user_id) \
+        .filter(*played) \
+        .group_by(Draw.lottery_round, Draw.user_id, User.draws_key) \
+        .order_by(Draw.lottery_round, Draw.user_id) \
+        .all()
+
+    archived = 0
+    for count, (lottery_round, group_user_id, draws_key) in enumerate(groups, 1):
+        group = played + [Draw.lottery_round == lottery_round, Draw.user_id == group_user_id]
+        # Lock the group's draws until the batch is committed, so play again and the scheduled job archiving at once
+        # never both archive them. The no-op update takes the write lock on databases without row locks, such as
+        # SQLite, and the archiver that waited finds no draws left and skips the group
+        locked = db.session.execute(update(Draw).where(*group).values(been_played=Draw.been_played)
+                                    .execution_options(synchronize_session=False)).rowcount
+        if not locked:
+            continue
+        rows = db.session.query(Draw.id, Draw.numbers, Draw.matches_master).filter(*group).order_by(Draw.id) \
+            .with_for_update().all()
+
+        # Decrypt each draw with the user's key, then encrypt the packed round as a whole with the same key
+        fernet = Fernet(draws_key)
+        draws = [([int(number) for number in fernet.decrypt(numbers).decode('utf-8').split()], matches_master)
+                 for _, numbers, matches_master in rows]
+
+        db.session.add(DrawArchive(lottery_round=lottery_round, user_id=group_user_id, draw_count=len(draws),
+                                   win_count=sum(matches_master for _, matches_master in draws),
+                                   draws=fernet.encrypt(pack_draws(draws)),
+                                   draw_ids=pack_ids([draw_id for draw_id, _, _ in rows])))
+        db.session.query(Draw).filter(*group).delete(synchronize_session=False)
+        # The fingerprints of a played round are no longer needed to find repeated draws
+        db.session.query(TicketFingerprint).filter_by(lottery_round=lottery_round, user_id=group_user_id) \
+            .delete(synchronize_session=False)
+        archived += len(draws)
+
+        if count % batch_size == 0:
+            db.session.commit()
+
+    db.session.commit()
+    return archived
+
+
+# Archive every settled round except the latest keep_rounds, so users can still check their latest results
+def archive_settled_rounds(keep_rounds=1):
+    latest_round = db.session.query(func.max(Draw.lottery_round)) \
+        .filter(Draw.been_played.is_(True), Draw.master_draw.is_(False)) \
+        .scalar()
+
+    if latest_round is None:
+        return 0
+    return archive_draws(max_round=latest_round - keep_rounds)
+
+
+# Return the space freed by deleted draws to the operating system
+def compact():
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        if connection.dialect.name == 'sqlite':
+            connection.exec_driver_sql('VACUUM')
+        elif connection.dialect.name == 'postgresql':
+            connection.exec_driver_sql('VACUUM ANALYZE draws')
+
+
+# Return the archived draws of a user as a list of (lottery round, numbers, matches_master), oldest round first
+def user_history(user):
+    fernet = Fernet(user.draws_key)
+    history = []
+    for archive in DrawArchive.query.filter_by(user_id=user.id).order_by(DrawArchive.lottery_round, DrawArchive.id):
+        history.extend((archive.lottery_round, ticket_to_string(numbers), matches_master)
+                       for numbers, matches_master in unpack_draws(fernet.decrypt(archive.draws)))
+    return history
+
+
+# Scheduled archiving and compaction, e.g. run nightly: flask --app app archive-draws --vacuum
+@app.cli.command('archive-draws')
+@click.option('--keep-rounds', type=int, default=1, help='Latest settled rounds to keep in the draws table.')
+@click.option('--vacuum', is_flag=True, help='Compact the database afterwards.')
+def archive_draws_command(keep_rounds, vacuum):
+    archived = archive_settled_rounds(keep_rounds)
+    click.echo('%d draws archived' % archived)
+
+    if vacuum:
+        compact()
+        click.echo('Database compacted')
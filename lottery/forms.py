@@ -1,40 +1,41 @@
-from flask import flash
 from flask_wtf import FlaskForm
-from wtforms import IntegerField, SubmitField, validators
-from wtforms.validators import DataRequired, NumberRange, ValidationError
+from wtforms import IntegerField, SubmitField
+from wtforms.validators import DataRequired, NumberRange
 
-
-# Custom validator that ensures each number is unique by accessing all the form's fields
-def validate_numbers(form, field):
-    # Extract numbers from the form fields into a list
-    numbers = [form.number1.data, form.number2.data, form.number3.data,
-               form.number4.data, form.number5.data, form.number6.data]
-    unique_number = set(numbers)
-    # Check if length of the numbers in the list is equal to six
-    if len(unique_number) != 6:
-        # Raise a validation error if the length is not six
-        raise validators.ValidationError('All numbers entered must be unique')
+from lottery.tickets import validate_ticket, TicketError
 
 
 class DrawForm(FlaskForm):
     # Defining each individual number field with validation
     number1 = IntegerField(id='no1',
-                           validators=[DataRequired(), NumberRange(1, 60, message="Must be between 1 and 60"),
-                                       validate_numbers])
+                           validators=[DataRequired(), NumberRange(1, 60, message="Must be between 1 and 60")])
     number2 = IntegerField(id='no2',
-                           validators=[DataRequired(), NumberRange(1, 60, message="Must be between 1 and 60"),
-                                       validate_numbers])
+                           validators=[DataRequired(), NumberRange(1, 60, message="Must be between 1 and 60")])
     number3 = IntegerField(id='no3',
-                           validators=[DataRequired(), NumberRange(1, 60, message="Must be between 1 and 60"),
-                                       validate_numbers])
+                           validators=[DataRequired(), NumberRange(1, 60, message="Must be between 1 and 60")])
     number4 = IntegerField(id='no4',
-                           validators=[DataRequired(), NumberRange(1, 60, message="Must be between 1 and 60"),
-                                       validate_numbers])
+                           validators=[DataRequired(), NumberRange(1, 60, message="Must be between 1 and 60")])
     number5 = IntegerField(id='no5',
-                           validators=[DataRequired(), NumberRange(1, 60, message="Must be between 1 and 60"),
-                                       validate_numbers])
+                           validators=[DataRequired(), NumberRange(1, 60, message="Must be between 1 and 60")])
     number6 = IntegerField(id='no6',
-                           validators=[DataRequired(), NumberRange(1, 60, message="Must be between 1 and 60"),
-                                       validate_numbers])
+                           validators=[DataRequired(), NumberRange(1, 60, message="Must be between 1 and 60")])
     # Submit button to submit the form
     submit = SubmitField("Submit Draw")
+
+    # The submitted numbers in ascending order, set once the form is valid
+    numbers = None
+
+    def validate(self, extra_validators=None):
+        # Validate each field on its own first
+        if not super().validate(extra_validators):
+            return False
+
+        # Then check all six numbers together once, instead of once per field
+        try:
+            self.numbers = validate_ticket([self.number1.data, self.number2.data, self.number3.data,
+                                            self.number4.data, self.number5.data, self.number6.data])
+        except TicketError as error:
+            self.number1.errors.append(str(error))
+            return False
+
+        return True
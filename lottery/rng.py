@@ -0,0 +1,42 @@
+# IMPORTS
+import secrets
+
+# CONFIG
+LOWEST_NUMBER = 1
+HIGHEST_NUMBER = 60
+NUMBERS_PER_DRAW = 6
+
+# Number of values a draw number can take
+NUMBER_RANGE = HIGHEST_NUMBER - LOWEST_NUMBER + 1
+# Largest multiple of NUMBER_RANGE that fits in a byte. Random bytes at or above it are rejected so every
+# number is equally likely, instead of the low numbers being favoured by byte % NUMBER_RANGE
+REJECTION_LIMIT = 256 - 256 % NUMBER_RANGE
+
+
+# Yield an endless stream of uniformly distributed draw numbers.
+# Random bytes are read from the operating system's secure generator in blocks of chunk_size
+def random_numbers(chunk_size=256):
+    while True:
+        for byte in secrets.token_bytes(chunk_size):
+            # Rejection sampling, roughly 6% of bytes are discarded
+            if byte < REJECTION_LIMIT:
+                yield LOWEST_NUMBER + byte % NUMBER_RANGE
+
+
+# Take six unique numbers from a stream of random numbers and return them in ascending order
+def draw_from(numbers):
+    draw = set()
+    while len(draw) < NUMBERS_PER_DRAW:
+        draw.add(next(numbers))
+    return sorted(draw)
+
+
+# Generate a single Lucky Dip or winning draw
+def lucky_dip():
+    return draw_from(random_numbers(chunk_size=32))
+
+
+# Generate count Lucky Dips at once for batch submissions, sharing one stream of random bytes between them
+def lucky_dips(count):
+    numbers = random_numbers(chunk_size=max(32, min(count * 8, 65536)))
+    return [draw_from(numbers) for _ in range(count)]
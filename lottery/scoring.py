@@ -0,0 +1,46 @@
+# Scoring of user draws against the winning numbers.
+# This module does not import the app, so settlement worker processes can import it without starting Flask.
+
+# IMPORTS
+from collections import Counter
+
+from cryptography.fernet import Fernet
+from sqlalchemy import create_engine
+
+from lottery.rng import NUMBERS_PER_DRAW
+
+
+# Score rows of (id, user_id, numbers, email, draws_key) against the winning numbers string.
+# Returns the winners as (draw id, numbers, user id, email) in the order of the rows, and the number of draws
+# matching each count of winning numbers (the prize tiers) as {matches: draws}.
+def score_draws(rows, winning_numbers):
+    winners = []
+    tiers = Counter()
+    winning_set = set(winning_numbers.split())
+    fernets = {}  # Fernet for each user's draw key, built once per user
+
+    for draw_id, user_id, numbers, email, draws_key in rows:
+        fernet = fernets.get(user_id)
+        if fernet is None:
+            fernet = fernets[user_id] = Fernet(draws_key)
+
+        # Each draw is encrypted with its owner's key, so it is decrypted with that key to compare the numbers
+        numbers = fernet.decrypt(numbers).decode('utf-8')
+        # Numbers are compared as sets, as draws stored before tickets were sorted keep the order they were typed in
+        matches = len(winning_set.intersection(numbers.split()))
+        tiers[matches] += 1
+        if matches == NUMBERS_PER_DRAW:
+            winners.append((draw_id, numbers, user_id, email))
+
+    return winners, tiers
+
+
+# Worker process entry point: score the draws selected by statement over its own database connection
+def score_shard(database_url, statement, winning_numbers, batch_size=1000):
+    engine = create_engine(database_url)
+    try:
+        with engine.connect() as connection:
+            rows = connection.execution_options(yield_per=batch_size).execute(statement)
+            return score_draws(rows, winning_numbers)
+    finally:
+        engine.dispose()
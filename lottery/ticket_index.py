@@ -0,0 +1,117 @@
+# IMPORTS
+import hashlib
+import hmac
+import threading
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy import select, update, func
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from lottery.tickets import TicketError
+from models import TicketFingerprint, TicketCount
+
+
+# Keyed hash of a ticket string. Keyed with the user's draws key, so the stored fingerprints reveal nothing about
+# the numbers, and the same numbers always give the same fingerprint for the same user
+def fingerprint(numbers, draws_key):
+    return hmac.new(draws_key, numbers.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+
+# Count count more draws against the user's quota for the open round in the current transaction, or raise a
+# TicketError if they would take the user over it. The conditional update holds the user's count row until the
+# transaction ends, so concurrent submissions from any process are counted one after the other
+def reserve_tickets(user_id, count):
+    quota = current_app.config['MAX_TICKETS_PER_ROUND']
+    reserved = db.session.execute(update(TicketCount)
+                                  .where(TicketCount.user_id == user_id, TicketCount.tickets + count <= quota)
+                                  .values(tickets=TicketCount.tickets + count)
+                                  .execution_options(synchronize_session=False)).rowcount
+    if reserved:
+        return
+
+    if db.session.get(TicketCount, user_id) is not None:
+        raise TicketError('You can submit at most %d draws per round' % quota)
+
+    # First submission since the count was introduced, start from the draws the user already has in the round
+    try:
+        with db.session.begin_nested():
+            db.session.add(TicketCount(user_id=user_id, tickets=open_round_tickets(user_id)))
+    except IntegrityError:
+        # Created at the same time by another request
+        pass
+    reserve_tickets(user_id, count)
+
+
+# Number of draws the user has submitted for the open round
+def open_round_tickets(user_id):
+    return db.session.execute(select(func.count(TicketFingerprint.id))
+                              .where(TicketFingerprint.user_id == user_id,
+                                     TicketFingerprint.lottery_round == 0)).scalar()
+
+
+# In memory index of the fingerprints of every user's draws in the open round (lottery_round 0).
+# Checks for duplicates and the per round quota in O(1) per ticket without touching the database.
+# The ticket_fingerprints table is the durable copy: the index is rebuilt from it on first use in each process and
+# after every settled round, and its unique constraint catches duplicates submitted through another process.
+class TicketIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fingerprints = None
+        self.user_locks = {}
+
+    # Lock held by a submission from check to add, so two submissions of one user in this process cannot both
+    # pass the check before either is recorded
+    def user_lock(self, user_id):
+        with self.lock:
+            return self.user_locks.setdefault(user_id, threading.Lock())
+
+    # Reload the open round's fingerprints from the database
+    def rebuild(self):
+        fingerprints = defaultdict(set)
+        for user_id, draw_fingerprint in db.session.execute(
+                select(TicketFingerprint.user_id, TicketFingerprint.fingerprint)
+                .where(TicketFingerprint.lottery_round == 0)):
+            fingerprints[user_id].add(draw_fingerprint)
+
+        with self.lock:
+            self.fingerprints = fingerprints
+
+    # Reload a single user's fingerprints, in case another process has settled the round since they were loaded
+    def reload_user(self, user_id):
+        user_fingerprints = set(db.session.execute(
+            select(TicketFingerprint.fingerprint)
+            .where(TicketFingerprint.user_id == user_id, TicketFingerprint.lottery_round == 0)).scalars())
+
+        with self.lock:
+            self.fingerprints[user_id] = user_fingerprints
+
+    # Raise a TicketError if the new fingerprints repeat a draw or would take the user over the quota
+    def check(self, user_id, new_fingerprints, reload=True):
+        if self.fingerprints is None:
+            self.rebuild()
+
+        quota = current_app.config['MAX_TICKETS_PER_ROUND']
+        with self.lock:
+            existing = self.fingerprints.get(user_id, set())
+            duplicate = len(set(new_fingerprints)) != len(new_fingerprints) or not existing.isdisjoint(new_fingerprints)
+            over_quota = len(existing) + len(new_fingerprints) > quota
+
+        if duplicate or over_quota:
+            # Confirm against the database before rejecting, as this process's copy may be out of date
+            if reload:
+                self.reload_user(user_id)
+                return self.check(user_id, new_fingerprints, reload=False)
+            if duplicate:
+                raise TicketError('You have already submitted this draw for the current round')
+            raise TicketError('You can submit at most %d draws per round' % quota)
+
+    # Record the fingerprints of draws that have been submitted
+    def add(self, user_id, new_fingerprints):
+        with self.lock:
+            if self.fingerprints is not None:
+                self.fingerprints[user_id].update(new_fingerprints)
+
+
+ticket_index = TicketIndex()
@@ -0,0 +1,45 @@
+# IMPORTS
+from lottery.rng import LOWEST_NUMBER, HIGHEST_NUMBER, NUMBERS_PER_DRAW
+
+
+# Raised when a ticket fails validation, the message is shown to the user
+class TicketError(ValueError):
+    pass
+
+
+# Check a ticket is six unique whole numbers between 1 and 60 and return them in ascending order.
+# Works on plain lists, so it is shared by the draw form, the JSON API and bulk imports.
+def validate_ticket(numbers):
+    if len(numbers) != NUMBERS_PER_DRAW:
+        raise TicketError('A draw must have exactly %d numbers' % NUMBERS_PER_DRAW)
+
+    # Numbers already seen are tracked as bits of an integer, so a duplicate is found in a single pass
+    seen = 0
+    for number in numbers:
+        # bool is a subclass of int but is not a valid number
+        if type(number) is not int:
+            raise TicketError('Numbers must be whole numbers')
+        if not LOWEST_NUMBER <= number <= HIGHEST_NUMBER:
+            raise TicketError('Must be between %d and %d' % (LOWEST_NUMBER, HIGHEST_NUMBER))
+        if seen >> number & 1:
+            raise TicketError('All numbers entered must be unique')
+        seen |= 1 << number
+
+    return sorted(numbers)
+
+
+# Validate a batch of tickets.
+# Returns the valid tickets in canonical order and a list of (index, message) for every invalid ticket
+def validate_tickets(tickets):
+    valid, errors = [], []
+    for index, numbers in enumerate(tickets):
+        try:
+            valid.append(validate_ticket(numbers))
+        except (TicketError, TypeError) as error:
+            errors.append((index, str(error) if isinstance(error, TicketError) else 'A draw must be a list'))
+    return valid, errors
+
+
+# String representation of a ticket, as stored (encrypted) in Draw.numbers
+def ticket_to_string(numbers):
+    return ' '.join(str(number) for number in numbers)
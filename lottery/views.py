@@ -2,11 +2,16 @@
 
 from flask import Blueprint, render_template, request, flash, redirect, url_for
 from flask_login import current_user, login_required
-from sqlalchemy.orm import make_transient
+from sqlalchemy.exc import IntegrityError
 
 from app import db, requires_roles
+from async_db import fetch_all, run_in_executor, async_version
+from lottery.archive import archive_draws
 from lottery.forms import DrawForm
-from models import Draw, User
+from lottery.ticket_index import ticket_index, fingerprint, reserve_tickets
+from lottery.tickets import ticket_to_string, TicketError
+from models import Draw, TicketFingerprint
+from queries import user_draws_statement, decrypt_draws
 
 # CONFIG
 lottery_blueprint = Blueprint('lottery', __name__, template_folder='templates')
@@ -32,20 +37,13 @@ def create_draw():
 
     # If form is valid i.e. all the fields are filled in correctly
     if form.validate_on_submit():
-        # Extract the submitted numbers from the form fields
-        submitted_numbers = (str(form.number1.data) + ' '
-                          + str(form.number2.data) + ' '
-                          + str(form.number3.data) + ' '
-                          + str(form.number4.data) + ' '
-                          + str(form.number5.data) + ' '
-                          + str(form.number6.data))
-
-        # Create a new draw with the form data
-        new_draw = Draw(user_id=current_user.id, numbers=submitted_numbers, master_draw=False, lottery_round=0,
-                        draws_key=current_user.draws_key)
-        # Add the new draw to the database
-        db.session.add(new_draw)
-        db.session.commit()
+        try:
+            # Store the submitted numbers in ascending order
+            submitted_numbers = submit_draw(form.numbers)
+        except TicketError as error:
+            # The draw repeats one already submitted this round or the user has reached the round's quota
+            flash(str(error))
+            return render_template('lottery/lottery.html', name=current_user.firstname, form=form)
 
         # Notify the user that the draw was submitted
         flash('Draw %s submitted.' % submitted_numbers)
@@ -56,24 +54,10 @@ def create_draw():
     return render_template('lottery/lottery.html', name=current_user.firstname, form=form)
 
 
-# View all draws that have not been played
-@lottery_blueprint.route('/view_draws', methods=['POST'])
-@login_required
-@requires_roles('user')
-def view_draws():
-    # Retrieve all draws that have not been played [played=False]
-    playable_draws = Draw.query.filter_by(been_played=False, user_id=current_user.id).all()
-
+# Render the lottery page with the playable draws, or notify the user that there are none
+def show_playable_draws(playable_draws):
     # Check if any playable draws exist
     if len(playable_draws) != 0:
-        # If playable draws exist, decrypt them for viewing by the user
-        for draw in playable_draws:
-            # Make each draw transient to allow decryption
-            make_transient(draw)
-            # Update the draw's numbers using the user's draws key
-            creator = User.query.filter_by(id=draw.user_id).first()
-            draw.view_draws(creator.draws_key)
-
         # Render lottery page with playable draws
         return render_template('lottery/lottery.html', playable_draws=playable_draws)
     # If no playable draw exists, notify the user and redirect to lottery page
@@ -82,14 +66,8 @@ def view_draws():
         return lottery()
 
 
-# View lottery results
-@lottery_blueprint.route('/check_draws', methods=['POST'])
-@login_required
-@requires_roles('user')
-def check_draws():
-    # Get all played draws for the current user
-    played_draws = Draw.query.filter_by(been_played=True, user_id=current_user.id).all()
-
+# Render the lottery page with the played draws, or notify the user that the round has not been played yet
+def show_played_draws(played_draws):
     # Check if played draws exist
     if len(played_draws) != 0:
         # If they exist, render the lottery page with the played draws
@@ -101,17 +79,121 @@ def check_draws():
         return lottery()
 
 
-# Delete all played draws
+# View all draws that have not been played, waiting on the async engine when ASYNC_DATABASE is on
+async def view_draws_async():
+    return show_playable_draws(await get_playable_draws_async())
+
+
+@lottery_blueprint.route('/view_draws', methods=['POST'])
+@login_required
+@requires_roles('user')
+@async_version(view_draws_async)
+def view_draws():
+    return show_playable_draws(get_playable_draws())
+
+
+# View lottery results, waiting on the async engine when ASYNC_DATABASE is on
+async def check_draws_async():
+    return show_played_draws(await get_played_draws_async())
+
+
+@lottery_blueprint.route('/check_draws', methods=['POST'])
+@login_required
+@requires_roles('user')
+@async_version(check_draws_async)
+def check_draws():
+    return show_played_draws(get_played_draws())
+
+
+# Archive all played draws
 @lottery_blueprint.route('/play_again', methods=['POST'])
 @login_required
 @requires_roles('user')
 def play_again():
-    # Delete all played draws created by the current user
-    Draw.query.filter_by(been_played=True, master_draw=False, user_id=current_user.id).delete(synchronize_session=False)
-    db.session.commit()
+    archive_played_draws()
 
-    # Notify the current user that all played draws have been deleted and the redirect to lottery page
-    flash("All played draws deleted.")
+    # Notify the current user that all played draws have been archived and the redirect to lottery page
+    flash("All played draws archived.")
     return lottery()
 
 
+# HELPERS
+# The operations behind each lottery button, shared by the views above and the JSON API (api/views.py)
+
+# Store a validated ticket as a new draw for the current user and return its string representation
+def submit_draw(numbers):
+    return submit_draws([numbers])[0]
+
+
+# Store a batch of validated tickets as new draws for the current user in a single transaction.
+# Raises a TicketError if a ticket repeats one already submitted this round or the batch exceeds the round's quota.
+def submit_draws(tickets):
+    submitted = [ticket_to_string(numbers) for numbers in tickets]
+    fingerprints = [fingerprint(numbers, current_user.draws_key) for numbers in submitted]
+
+    with ticket_index.user_lock(current_user.id):
+        # Check for repeated draws and the quota in memory, without decrypting the user's existing draws
+        ticket_index.check(current_user.id, fingerprints)
+
+        # Create a new draw for each ticket and add them to the database
+        draws = [Draw(user_id=current_user.id, numbers=numbers, master_draw=False, lottery_round=0,
+                      draws_key=current_user.draws_key) for numbers in submitted]
+
+        try:
+            # Count the draws against the quota in the database, which holds across every process
+            reserve_tickets(current_user.id, len(draws))
+            db.session.add_all(draws)
+            # Flush to assign the draw ids, then record a fingerprint for each draw
+            db.session.flush()
+            db.session.add_all([TicketFingerprint(user_id=current_user.id, draw_id=draw.id,
+                                                  fingerprint=draw_fingerprint)
+                                for draw, draw_fingerprint in zip(draws, fingerprints)])
+            db.session.commit()
+        except TicketError:
+            db.session.rollback()
+            ticket_index.reload_user(current_user.id)
+            raise
+        except IntegrityError:
+            # The same draw was submitted at the same time through another process
+            db.session.rollback()
+            ticket_index.reload_user(current_user.id)
+            raise TicketError('You have already submitted this draw for the current round')
+
+        ticket_index.add(current_user.id, fingerprints)
+    return submitted
+
+
+# Return the current user's draws matching been_played with their numbers decrypted
+def get_decrypted_draws(been_played):
+    statement = user_draws_statement(current_user.id, been_played)
+    return decrypt_draws(db.session.execute(statement).all(), current_user.draws_key)
+
+
+# Return all draws of the current user that have not been played [played=False]
+def get_playable_draws():
+    return get_decrypted_draws(been_played=False)
+
+
+# Return all played draws of the current user
+def get_played_draws():
+    return get_decrypted_draws(been_played=True)
+
+
+# Async versions of the above for the async views. The query runs on the async engine and the decryption on a
+# worker thread, so the event loop is never blocked
+async def get_decrypted_draws_async(been_played):
+    rows = await fetch_all(user_draws_statement(current_user.id, been_played))
+    return await run_in_executor(decrypt_draws, rows, current_user.draws_key)
+
+
+async def get_playable_draws_async():
+    return await get_decrypted_draws_async(been_played=False)
+
+
+async def get_played_draws_async():
+    return await get_decrypted_draws_async(been_played=True)
+
+
+# Move all played draws created by the current user to the archive
+def archive_played_draws():
+    return archive_draws(user_id=current_user.id)
@@ -5,7 +5,17 @@ from flask import request
 from app import db, app
 from flask_login import UserMixin
 from datetime import datetime
+from functools import cached_property
 from cryptography.fernet import Fernet
+from permissions import role_permissions
+
+
+# URI of a user's 2FA secret for an authenticator app, shown as a QR code when the user sets up 2FA
+def provisioning_uri(pin_key, email):
+    return str(pyotp.totp.TOTP(pin_key).provisioning_uri(
+        name=email,
+        issuer_name='Lottery Web App')
+        )
 
 
 class User(db.Model, UserMixin):
@@ -26,11 +36,6 @@ class User(db.Model, UserMixin):
     role = db.Column(db.String(100), nullable=False, default='user')
     pin_key = db.Column(db.String(32), nullable=False, default=pyotp.random_base32())
     registered_on = db.Column(db.DateTime, nullable=False)
-    current_login = db.Column(db.DateTime, nullable=True)
-    last_login = db.Column(db.DateTime, nullable=True)
-    current_ip = db.Column(db.String(100), nullable=True)
-    last_ip = db.Column(db.String(100), nullable=True)
-    total_no_logins = db.Column(db.Integer, nullable=True)
 
     # encryption key for each user
     draws_key = db.Column(db.BLOB, nullable=False, default=Fernet.generate_key())
@@ -48,17 +53,14 @@ class User(db.Model, UserMixin):
         self.password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
         self.role = role
         self.registered_on = datetime.now()
-        self.current_login = None
-        self.last_login = None
-        self.current_ip = None
-        self.last_ip = None
-        self.total_no_logins = 0
+
+    # Permission bitmask of the user's role, resolved once per loaded user
+    @cached_property
+    def permissions(self):
+        return role_permissions(self.role)
 
     def get_2fa_uri(self):
-        return str(pyotp.totp.TOTP(self.pin_key).provisioning_uri (
-            name=self.email,
-            issuer_name='Lottery Web App')
-            )
+        return provisioning_uri(self.pin_key, self.email)
 
     def verify_pin(self, pin):
         return pyotp.TOTP(self.pin_key).verify(pin)
@@ -98,8 +100,114 @@ class Draw(db.Model):
         self.master_draw = master_draw
         self.lottery_round = lottery_round
 
-    def view_draws(self, draws_key):
-        self.numbers = decrypt(self.numbers, draws_key)
+
+class TicketFingerprint(db.Model):
+    __tablename__ = 'ticket_fingerprints'
+    # A user cannot submit the same numbers twice in a round
+    __table_args__ = (db.UniqueConstraint('user_id', 'lottery_round', 'fingerprint'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    # User and draw the fingerprint belongs to
+    user_id = db.Column(db.Integer, db.ForeignKey(User.id), nullable=False)
+    draw_id = db.Column(db.Integer, nullable=False)
+
+    # Lottery round of the draw, 0 until the round is played as for Draw
+    lottery_round = db.Column(db.Integer, nullable=False, default=0)
+
+    # Keyed hash of the draw's numbers (see lottery/ticket_index.py), so duplicates are found without decrypting
+    fingerprint = db.Column(db.String(32), nullable=False)
+
+    def __init__(self, user_id, draw_id, fingerprint):
+        self.user_id = user_id
+        self.draw_id = draw_id
+        self.lottery_round = 0
+        self.fingerprint = fingerprint
+
+
+class TicketCount(db.Model):
+    __tablename__ = 'ticket_counts'
+
+    # Draws each user has submitted for the open round (lottery_round 0). The per round quota is enforced by a
+    # conditional update of this row in the same transaction as the draws, so it holds across processes
+    user_id = db.Column(db.Integer, db.ForeignKey(User.id), primary_key=True)
+    tickets = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DrawArchive(db.Model):
+    __tablename__ = 'draws_archive'
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    # Lottery round and user the archived draws belong to. Each row holds one user's draws for one round
+    lottery_round = db.Column(db.Integer, nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey(User.id), nullable=False, index=True)
+
+    # Number of archived draws and how many of them matched the master draw
+    draw_count = db.Column(db.Integer, nullable=False)
+    win_count = db.Column(db.Integer, nullable=False)
+
+    # The draws packed as 8 byte bitmasks (see lottery/archive.py), encrypted with the user's draws key
+    draws = db.Column(db.BLOB, nullable=False)
+
+    # Ids the draws had in the draws table, packed as 8 byte integers in the same order, so exports keep them
+    draw_ids = db.Column(db.BLOB, nullable=True)
+
+    archived_on = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, lottery_round, user_id, draw_count, win_count, draws, draw_ids):
+        self.lottery_round = lottery_round
+        self.user_id = user_id
+        self.draw_count = draw_count
+        self.win_count = win_count
+        self.draws = draws
+        self.draw_ids = draw_ids
+        self.archived_on = datetime.now()
+
+
+class LoginEvent(db.Model):
+    __tablename__ = 'login_events'
+
+    # Logins are only ever appended. The id orders them for aggregation (see users/activity.py)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey(User.id), nullable=False)
+    logged_in_on = db.Column(db.DateTime, nullable=False)
+    ip = db.Column(db.String(100), nullable=True)
+
+    def __init__(self, user_id, ip):
+        self.user_id = user_id
+        self.logged_in_on = datetime.now()
+        self.ip = ip
+
+
+class UserLoginRollup(db.Model):
+    __tablename__ = 'user_login_rollups'
+
+    # One row per user who has logged in, built from login_events
+    user_id = db.Column(db.Integer, db.ForeignKey(User.id), primary_key=True)
+    total_no_logins = db.Column(db.Integer, nullable=False, default=0)
+
+    # The latest login and the one before it
+    current_login = db.Column(db.DateTime, nullable=True)
+    current_ip = db.Column(db.String(100), nullable=True)
+    last_login = db.Column(db.DateTime, nullable=True)
+    last_ip = db.Column(db.String(100), nullable=True)
+
+
+class DailyLoginRollup(db.Model):
+    __tablename__ = 'daily_login_rollups'
+
+    # Logins on each day, built from login_events
+    day = db.Column(db.Date, primary_key=True)
+    total_no_logins = db.Column(db.Integer, nullable=False, default=0)
+
+
+class RollupCheckpoint(db.Model):
+    __tablename__ = 'rollup_checkpoints'
+
+    # Id of the last event of the named log that has been added to its rollups
+    name = db.Column(db.String(100), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
 
 
 def init_db():
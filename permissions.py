@@ -0,0 +1,42 @@
+# IMPORTS
+from enum import IntFlag
+from functools import lru_cache
+
+from flask_login import AnonymousUserMixin
+
+
+# CONFIG
+# Every action guarded by a role is a bit, so a role's permissions are one integer and a check is one AND
+class Permission(IntFlag):
+    NONE = 0
+    PLAY_LOTTERY = 1  # Submit, view and check draws
+    MANAGE_LOTTERY = 2  # Create winning draws, run rounds and export draws
+    MANAGE_USERS = 4  # View users, their activity and the security logs, and register admins
+
+
+# Permissions granted to each role. A role must be added here before a view can require it
+ROLE_PERMISSIONS = {'user': Permission.PLAY_LOTTERY,
+                    'admin': Permission.MANAGE_LOTTERY | Permission.MANAGE_USERS}
+
+
+# Permissions of a role, resolved once per role. Unknown roles get no permissions
+@lru_cache(maxsize=None)
+def role_permissions(role):
+    return ROLE_PERMISSIONS.get(role, Permission.NONE)
+
+
+# Permission masks a principal must hold one of to pass requires_roles(*roles), resolved once per decorated view.
+# Raises a KeyError for a role missing from ROLE_PERMISSIONS, so a typo fails at import instead of locking users out
+def required_masks(roles):
+    return tuple(ROLE_PERMISSIONS[role] for role in roles)
+
+
+# True if the permissions hold every permission of at least one of the masks
+def is_authorised(permissions, masks):
+    return any(permissions & mask == mask for mask in masks)
+
+
+# Used by Flask-Login for visitors who are not logged in, so checks never need to special case them
+class AnonymousUser(AnonymousUserMixin):
+    role = None
+    permissions = Permission.NONE
@@ -0,0 +1,148 @@
+# Read path for the listing pages and the lottery round.
+# Queries select only the columns a page needs into plain rows instead of hydrating User/Draw objects, and
+# decrypted numbers go into separate view objects, so they are never tracked by the session or flushed back.
+
+# IMPORTS
+from dataclasses import dataclass, asdict
+from datetime import date, datetime
+
+from cryptography.fernet import Fernet
+from sqlalchemy import select, func
+
+from app import db
+from models import User, Draw, UserLoginRollup, DailyLoginRollup
+
+
+# VIEW OBJECTS
+@dataclass(frozen=True, slots=True)
+class DrawView:
+    id: int
+    numbers: str
+    lottery_round: int
+    been_played: bool
+    matches_master: bool
+
+
+@dataclass(frozen=True, slots=True)
+class UserView:
+    id: int
+    email: str
+    firstname: str
+    lastname: str
+    phone: str
+    date_of_birth: str
+    postcode: str
+    role: str
+    registered_on: datetime
+    current_login: datetime
+
+
+# Login activity of a user as of the last aggregation of the login events (see users/activity.py)
+@dataclass(frozen=True, slots=True)
+class UserActivityView:
+    id: int
+    email: str
+    registered_on: datetime
+    current_login: datetime
+    last_login: datetime
+    current_ip: str
+    last_ip: str
+    total_no_logins: int
+
+
+@dataclass(frozen=True, slots=True)
+class DailyLoginsView:
+    day: date
+    total_no_logins: int
+
+
+# Dictionary of a view object for the JSON API, with dates in ISO 8601 format
+def view_to_dict(view):
+    return {name: value.isoformat() if isinstance(value, (date, datetime)) else value
+            for name, value in asdict(view).items()}
+
+
+# STATEMENTS
+# A user's draws matching been_played
+def user_draws_statement(user_id, been_played):
+    return select(Draw.id, Draw.numbers, Draw.lottery_round, Draw.been_played, Draw.matches_master) \
+        .where(Draw.user_id == user_id, Draw.been_played == been_played)
+
+
+# Unplayed user draws up to max_draw_id joined to their owner's email and key, ordered by draw id.
+# With shard_count > 1 only the draws of users where user_id % shard_count == shard are selected.
+# Built from the tables rather than the models so the statement can be pickled and sent to a worker process.
+def unplayed_draws_statement(max_draw_id, shard=0, shard_count=1):
+    draws, users = Draw.__table__, User.__table__
+    statement = select(draws.c.id, draws.c.user_id, draws.c.numbers, users.c.email, users.c.draws_key) \
+        .join(users, users.c.id == draws.c.user_id) \
+        .where(draws.c.master_draw.is_(False), draws.c.been_played.is_(False), draws.c.id <= max_draw_id)
+
+    if shard_count > 1:
+        statement = statement.where(draws.c.user_id % shard_count == shard)
+    return statement.order_by(draws.c.id)
+
+
+# Registered users with the role of 'user' joined to their login rollup, which is empty until they have logged in
+def registered_users_statement(*columns):
+    return select(*columns) \
+        .outerjoin(UserLoginRollup, UserLoginRollup.user_id == User.id) \
+        .where(User.role == 'user') \
+        .order_by(User.id)
+
+
+# Login columns are read from the rollup, every other column from the user
+def user_column(name):
+    return getattr(UserLoginRollup if hasattr(UserLoginRollup, name) else User, name)
+
+
+# DECRYPTION
+# Decrypt draw rows belonging to one user into DrawViews
+def decrypt_draws(rows, draws_key):
+    fernet = Fernet(draws_key)
+    return [DrawView(row.id, fernet.decrypt(row.numbers).decode('utf-8'), row.lottery_round, row.been_played,
+                     row.matches_master) for row in rows]
+
+
+# QUERIES
+# The current unplayed winning draw decrypted with its creator's key, or None if there is none
+def get_winning_draw():
+    row = db.session.execute(
+        select(Draw.id, Draw.numbers, Draw.lottery_round, Draw.been_played, Draw.matches_master, User.draws_key)
+        .join(User, User.id == Draw.user_id)
+        .where(Draw.master_draw.is_(True), Draw.been_played.is_(False))
+        .limit(1)).first()
+
+    if row is None:
+        return None
+    return decrypt_draws([row], row.draws_key)[0]
+
+
+def get_registered_users():
+    columns = [user_column(name) for name in UserView.__slots__]
+    return [UserView(*row) for row in db.session.execute(registered_users_statement(*columns))]
+
+
+# One page of user activity, pages numbered from 1. Returns the page's UserActivityViews and whether there is
+# a next page
+def get_user_activity(page=1, per_page=50):
+    columns = [user_column(name) for name in UserActivityView.__slots__]
+    # One extra row is read to tell if there is a next page without counting every user
+    rows = db.session.execute(registered_users_statement(*columns)
+                              .limit(per_page + 1)
+                              .offset((max(page, 1) - 1) * per_page)).all()
+    return [UserActivityView(*row) for row in rows[:per_page]], len(rows) > per_page
+
+
+# Logins per day for the latest days that had any, latest first
+def get_daily_logins(days=14):
+    return [DailyLoginsView(*row) for row in db.session.execute(
+        select(DailyLoginRollup.day, DailyLoginRollup.total_no_logins)
+        .order_by(DailyLoginRollup.day.desc())
+        .limit(days))]
+
+
+# Id of the latest unplayed user draw, or None if there are none
+def get_last_unplayed_draw_id():
+    return db.session.execute(select(func.max(Draw.id))
+                              .where(Draw.master_draw.is_(False), Draw.been_played.is_(False))).scalar()
@@ -0,0 +1,169 @@
+# Monte Carlo simulation of lottery rounds for capacity planning.
+# Fills a scratch SQLite database with synthetic users and draws, settles the round through the same code path as
+# admin.run_lottery and reports time, memory, winners per prize tier and database growth for each round size.
+# Run with: python simulate.py --tickets 10000 100000 1000000 --distribution popular --shards 1 4
+
+# IMPORTS
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+# CONFIG
+DISTRIBUTIONS = ('uniform', 'popular')
+# Weight of the numbers players pick more often than others under the 'popular' distribution, as a multiple of skew:
+# birthdays (1-31), and 7, the favourite lucky number, which is also a birthday and weighted twice as much again
+POPULAR_WEIGHTS = {**{number: 1.0 for number in range(1, 32)}, 7: 2.0}
+# Rows inserted per statement while seeding
+SEED_BATCH_SIZE = 10000
+
+
+# Point the app at a new SQLite database in a temporary directory. Must be called before the app is imported
+def use_scratch_database():
+    path = os.path.join(tempfile.mkdtemp(prefix='lottery_simulation_'), 'scratch.db')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    os.environ['SQLALCHEMY_ECHO'] = 'False'
+    os.environ.setdefault('SECRET_KEY', 'simulation')
+    return path
+
+
+# Return a function picking six unique numbers from 1-60 under the given distribution.
+# Under 'popular' each birthday is skew times as likely to be picked as a number above 31, and 7 twice that
+def ticket_picker(distribution, generator, skew=3.0):
+    population = list(range(1, 61))
+    if distribution == 'uniform':
+        return lambda: sorted(generator.sample(population, 6))
+
+    weights = [skew * POPULAR_WEIGHTS[number] if number in POPULAR_WEIGHTS else 1.0 for number in population]
+
+    def pick():
+        ticket = set()
+        while len(ticket) < 6:
+            ticket.update(generator.choices(population, weights, k=6 - len(ticket)))
+        return sorted(ticket)
+    return pick
+
+
+# Fill the database with users, their unplayed draws and a winning draw for round 1.
+# With winner_every set, every winner_every-th draw is given the winning numbers. Returns the winning numbers string
+def seed_round(users, tickets, distribution='uniform', seed=2031, skew=3.0, winner_every=None):
+    from cryptography.fernet import Fernet
+    from sqlalchemy import insert
+
+    from app import db
+    from lottery.tickets import ticket_to_string
+    from models import User, Draw
+
+    generator = random.Random(seed)
+    pick = ticket_picker(distribution, generator, skew)
+
+    # User 1 is the admin who creates the winning draw
+    keys = [Fernet.generate_key() for _ in range(users + 1)]
+    fernets = [Fernet(key) for key in keys]
+    db.session.execute(insert(User), [{'email': 'user%d@example.com' % i, 'password': b'', 'firstname': 'User',
+                                       'lastname': str(i), 'phone': '0191-123-4567', 'date_of_birth': '01/01/2000',
+                                       'postcode': 'NE1 7RU', 'role': 'admin' if i == 0 else 'user',
+                                       'pin_key': 'SIMULATION', 'draws_key': keys[i],
+                                       'registered_on': datetime.now()}
+                                      for i in range(users + 1)])
+
+    # The winning draw is always uniform, whatever the players' distribution
+    winning_numbers = ticket_to_string(sorted(generator.sample(range(1, 61), 6)))
+    db.session.execute(insert(Draw), [{'user_id': 1, 'numbers': fernets[0].encrypt(winning_numbers.encode('utf-8')),
+                                       'been_played': False, 'matches_master': False, 'master_draw': True,
+                                       'lottery_round': 1}])
+
+    for start in range(0, tickets, SEED_BATCH_SIZE):
+        rows = []
+        for i in range(start, min(start + SEED_BATCH_SIZE, tickets)):
+            user = generator.randint(1, users)
+            numbers = winning_numbers if winner_every and i % winner_every == 0 else ticket_to_string(pick())
+            rows.append({'user_id': user + 1, 'numbers': fernets[user].encrypt(numbers.encode('utf-8')),
+                         'been_played': False, 'matches_master': False, 'master_draw': False, 'lottery_round': 0})
+        db.session.execute(insert(Draw), rows)
+        db.session.commit()
+
+    return winning_numbers
+
+
+# Simulate one round of the given size on an empty database and return its measurements
+def simulate_round(path, tickets, args, shard_count):
+    from app import db
+    from admin.settlement import settle_round
+    from lottery.archive import compact
+    from queries import get_winning_draw
+
+    db.drop_all()
+    db.create_all()
+    compact()
+    empty_size = os.path.getsize(path)
+
+    start = time.perf_counter()
+    seed_round(args.users, tickets, args.distribution, args.seed, args.skew)
+    seed_time = time.perf_counter() - start
+    seeded_size = os.path.getsize(path)
+
+    # Settle the round end to end as admin.run_lottery does.
+    # Tracing memory slows settlement down, so memory and time are only measured together when asked for
+    if args.trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    results, tiers = settle_round(get_winning_draw(), shard_count)
+    settle_time = time.perf_counter() - start
+    peak_memory = None
+    if args.trace_memory:
+        peak_memory = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        tracemalloc.stop()
+
+    return {'tickets': tickets,
+            'shards': shard_count,
+            'seed_seconds': round(seed_time, 3),
+            'settle_seconds': round(settle_time, 3),
+            'tickets_per_second': round(tickets / settle_time),
+            'peak_memory_mb': peak_memory,
+            'db_growth_mb': round((seeded_size - empty_size) / 2 ** 20, 1),
+            'bytes_per_ticket': round((seeded_size - empty_size) / tickets),
+            'winners': len(results),
+            **{'tier_%d' % matches: tiers[matches] for matches in range(7)}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate lottery rounds to plan capacity')
+    parser.add_argument('--tickets', type=int, nargs='+', default=[10000, 100000],
+                        help='Round sizes to simulate, e.g. 10000 100000 1000000 10000000')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='uniform')
+    parser.add_argument('--skew', type=float, default=3.0, help='Weight of popular numbers')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1], help='Settlement worker processes')
+    parser.add_argument('--seed', type=int, default=2031)
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Report the peak memory allocated by the web process while settling')
+    parser.add_argument('--csv', help='Also write the results to this CSV file')
+    args = parser.parse_args()
+
+    path = use_scratch_database()
+    from app import app
+
+    rows = []
+    with app.app_context():
+        for tickets in args.tickets:
+            for shard_count in args.shards:
+                row = simulate_round(path, tickets, args, shard_count)
+                rows.append(row)
+                print(', '.join('%s=%s' % item for item in row.items()))
+                sys.stdout.flush()
+
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+// Admin and lottery page buttons backed by the JSON API (/api/v1).
+// A form with a data-api attribute fetches that endpoint and updates only its own section (data-api-target) with
+// the renderer named by data-api-render, instead of reloading and re-rendering the whole page.
+// Without JavaScript, or if the request cannot be sent, the form submits to its page view as before.
+
+// Show a message in the page's notification box
+function showMessage(text) {
+    const box = document.getElementById("api-message");
+    box.textContent = text;
+    box.hidden = !text;
+}
+
+// Create an element with the given text. Text is always set with textContent so data is never parsed as HTML
+function element(tag, text) {
+    const node = document.createElement(tag);
+    if (text !== undefined && text !== null) {
+        node.textContent = text;
+    }
+    return node;
+}
+
+// Format an ISO 8601 date from the API as the pages do, e.g. 19/10/2026 11:39:29
+function formatDate(value) {
+    return value ? new Date(value).toLocaleString("en-GB").replace(",", "") : "";
+}
+
+// Build a table with a header row and one row per item of rows, each a list of cell texts
+function table(headers, rows) {
+    const result = element("table");
+    result.className = "table";
+    const header = element("tr");
+    headers.forEach(function (name) {
+        header.appendChild(element("th", name));
+    });
+    result.appendChild(header);
+    rows.forEach(function (cells) {
+        const row = element("tr");
+        cells.forEach(function (cell) {
+            row.appendChild(element("td", cell));
+        });
+        result.appendChild(row);
+    });
+    return result;
+}
+
+// Show one form of the lottery page's Check Result / Play Again pair and hide the other
+function showPlayAgain(played) {
+    document.getElementById("check-draws-form").hidden = played;
+    document.getElementById("play-again-form").hidden = !played;
+}
+
+// Functions updating a section from an endpoint's response, named by the forms' data-api-render attributes
+const renderers = {
+    message: function (data) {
+        showMessage(data.message);
+    },
+
+    winningDraw: function (data, target) {
+        target.replaceChildren(element("p", "Round " + data.winning_draw.lottery_round),
+            element("p", data.winning_draw.numbers));
+    },
+
+    lotteryResults: function (data, target) {
+        showMessage(data.results.length ? "" : "No winners.");
+        target.replaceChildren.apply(target, data.results.map(function (result) {
+            return element("p", [result.lottery_round, result.numbers, result.user_id, result.email].join(", "));
+        }));
+    },
+
+    users: function (data, target) {
+        target.replaceChildren(table(
+            ["ID", "Email", "Firstname", "Lastname", "Phone No.", "Date of Birth", "Postcode", "Role", "Registered",
+                "Logged In"],
+            data.users.map(function (user) {
+                return [user.id, user.email, user.firstname, user.lastname, user.phone, user.date_of_birth,
+                    user.postcode, user.role, formatDate(user.registered_on),
+                    user.current_login ? formatDate(user.current_login) : "Not yet logged in"];
+            })));
+    },
+
+    logs: function (data, target) {
+        target.replaceChildren(table(["Last 10 Security Log Entries"], data.logs.map(function (entry) {
+            return [entry];
+        })));
+    },
+
+    userActivity: function (data, target, form) {
+        const pager = element("div");
+        pager.className = "field";
+        if (data.page > 1) {
+            pager.appendChild(pageButton(form, data.page - 1, "Previous"));
+        }
+        pager.appendChild(element("span", "Page " + data.page));
+        if (data.has_next) {
+            pager.appendChild(pageButton(form, data.page + 1, "Next"));
+        }
+
+        target.replaceChildren(
+            table(["ID", "Email", "Registration Time", "Current Log In Time", "Last Login Time", "Current IP",
+                    "Last IP", "Total No. of Log Ins"],
+                data.users.map(function (user) {
+                    if (!user.current_login) {
+                        return [user.id, user.email, formatDate(user.registered_on), "Not yet logged in"];
+                    }
+                    return [user.id, user.email, formatDate(user.registered_on), formatDate(user.current_login),
+                        formatDate(user.last_login), user.current_ip, user.last_ip, user.total_no_logins];
+                })),
+            pager,
+            table(["Day", "Log Ins"], data.daily_logins.map(function (day) {
+                return [new Date(day.day).toLocaleDateString("en-GB"), day.total_no_logins];
+            })));
+    },
+
+    playableDraws: function (data, target) {
+        showMessage(data.draws.length ? "" : "No playable draws.");
+        target.replaceChildren.apply(target, data.draws.map(function (draw) {
+            return element("p", draw.numbers);
+        }));
+    },
+
+    drawResults: function (data, target) {
+        showMessage(data.results.length ? "" : "Next round of lottery yet to play. Check you have playable draws.");
+        target.replaceChildren(table(["Round", "Draw", "Played", "Match"], data.results.map(function (draw) {
+            return [draw.lottery_round, draw.numbers, draw.been_played ? "True" : "False",
+                draw.matches_master ? "True" : "False"];
+        })));
+        showPlayAgain(data.results.length > 0);
+    },
+
+    playAgain: function (data, target) {
+        showMessage(data.message);
+        target.replaceChildren();
+        showPlayAgain(false);
+    }
+};
+
+// Previous / Next button loading another page of a paginated section
+function pageButton(form, page, label) {
+    const button = element("button", label);
+    button.type = "button";
+    button.className = "button is-small";
+    button.addEventListener("click", function () {
+        callApi(form, form.dataset.api + "?page=" + page);
+    });
+    return button;
+}
+
+// Request body of a form: the six numbers of the create draw form, or nothing
+function requestBody(form) {
+    if (form.dataset.apiBody !== "numbers") {
+        return undefined;
+    }
+    const numbers = [];
+    for (let i = 1; i <= 6; i++) {
+        numbers.push(Number(form.elements["number" + i].value));
+    }
+    return JSON.stringify({numbers: numbers});
+}
+
+async function callApi(form, url) {
+    const body = requestBody(form);
+    let response;
+    try {
+        response = await fetch(url, {
+            method: form.dataset.apiMethod || "GET",
+            credentials: "same-origin",
+            headers: body ? {"Content-Type": "application/json"} : {},
+            body: body
+        });
+    } catch (error) {
+        // The API could not be reached, fall back to the page view
+        form.submit();
+        return;
+    }
+
+    const data = await response.json().catch(function () {
+        return {};
+    });
+    if (!response.ok) {
+        const errors = (data.errors || []).map(function (error) {
+            return error.error;
+        });
+        showMessage(data.error || errors.join(" ") || "The request failed, please try again.");
+        return;
+    }
+    renderers[form.dataset.apiRender](data, document.getElementById(form.dataset.apiTarget), form);
+}
+
+document.addEventListener("submit", function (event) {
+    const form = event.target;
+    if (!form.dataset.api) {
+        return;
+    }
+    event.preventDefault();
+    callApi(form, form.dataset.api);
+});
@@ -4,22 +4,25 @@ function luckyDip() {
     // Create empty set
     let draw = new Set();
 
+    const min = 1;
+    const max = 60;
+    const range = max - min + 1;
+    // Largest multiple of the range that fits in a byte. Bytes at or above it are rejected so every
+    // value is equally likely (the same rejection sampling as lottery/rng.py on the server)
+    const limit = 256 - 256 % range;
+
     // While set does not contain 6 values, create a random value between 1 and 60
     while (draw.size < 6) {
-        min = 1;
-        max = 60;
-        // Create an array of length 6
-        randomBuffer = new Uint32Array(6);
+        // Create an array of random bytes
+        let randomBuffer = new Uint8Array(16);
         // Filling the array with cryptographically secure integers
-        window.crypto.getRandomValues(randomBuffer)
-
-        for (let i = 0; i < randomBuffer.length; i++) {
-
-            csRandomNumber = randomBuffer[i] / (0xFFFFFFFF)
-            value = Math.floor(csRandomNumber * (max - min + 1) + min);
+        window.crypto.getRandomValues(randomBuffer);
 
-            // Sets cannot contain duplicates so value is only added if it does not exist in set
-            draw.add(value)
+        for (let i = 0; i < randomBuffer.length && draw.size < 6; i++) {
+            if (randomBuffer[i] < limit) {
+                // Sets cannot contain duplicates so value is only added if it does not exist in set
+                draw.add(min + randomBuffer[i] % range);
+            }
         }
     }
 
@@ -35,4 +38,4 @@ function luckyDip() {
     for (let i = 0; i < 6; i++) {
         document.getElementById("no" + (i + 1)).value = a[i];
     }
-}
\ No newline at end of file
+}
@@ -0,0 +1,130 @@
+# IMPORTS
+import time
+from collections import Counter
+
+import click
+from sqlalchemy import select, update, insert, inspect, func, table, column
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import LoginEvent, UserLoginRollup, DailyLoginRollup, RollupCheckpoint
+
+# CONFIG
+CHECKPOINT = 'login_events'
+# Checkpoint recording that the login columns the users table had before login_events have been backfilled
+BACKFILL_CHECKPOINT = 'users_login_columns'
+LEGACY_LOGIN_COLUMNS = ('current_login', 'last_login', 'current_ip', 'last_ip', 'total_no_logins')
+
+
+# Append a login to the activity log. The users table is not touched, so logins never contend for its rows
+def record_login(user_id, ip):
+    db.session.add(LoginEvent(user_id, ip))
+    db.session.commit()
+
+
+# Return the named checkpoint locked until the end of the transaction, creating it if it does not exist.
+# The no-op update takes the write lock on databases without row locks, such as SQLite, so two aggregators running
+# at once take turns instead of both reading the same events
+def lock_checkpoint(name):
+    if db.session.get(RollupCheckpoint, name) is None:
+        try:
+            with db.session.begin_nested():
+                db.session.add(RollupCheckpoint(name=name, last_id=0))
+        except IntegrityError:
+            # Created at the same time by another aggregator
+            pass
+
+    db.session.execute(update(RollupCheckpoint).where(RollupCheckpoint.name == name)
+                       .values(last_id=RollupCheckpoint.last_id)
+                       .execution_options(synchronize_session=False))
+    return db.session.get(RollupCheckpoint, name, with_for_update=True, populate_existing=True)
+
+
+# Copy the logins recorded in the users table before login_events into the user rollups, once.
+# Users who have logged in since get the old login count added and the old latest login as their previous one.
+def backfill_login_rollups():
+    checkpoint = lock_checkpoint(BACKFILL_CHECKPOINT)
+    existing_columns = {existing['name'] for existing in inspect(db.engine).get_columns('users')}
+    if checkpoint.last_id or not existing_columns.issuperset(LEGACY_LOGIN_COLUMNS):
+        checkpoint.last_id = 1
+        db.session.commit()
+        return
+
+    # The columns are no longer in the User model, so they are read through a lightweight table
+    users = table('users', column('id'), *(column(name) for name in LEGACY_LOGIN_COLUMNS))
+    rollups = UserLoginRollup.__table__
+    user = users.c.id == rollups.c.user_id
+    db.session.execute(rollups.update().values(
+        total_no_logins=rollups.c.total_no_logins +
+        select(func.coalesce(users.c.total_no_logins, 0)).where(user).scalar_subquery(),
+        last_login=func.coalesce(rollups.c.last_login, select(users.c.current_login).where(user).scalar_subquery()),
+        last_ip=func.coalesce(rollups.c.last_ip, select(users.c.current_ip).where(user).scalar_subquery())))
+    db.session.execute(insert(rollups).from_select(
+        ['user_id', 'total_no_logins', 'current_login', 'current_ip', 'last_login', 'last_ip'],
+        select(users.c.id, func.coalesce(users.c.total_no_logins, 0), users.c.current_login, users.c.current_ip,
+               users.c.last_login, users.c.last_ip)
+        .where(users.c.current_login.is_not(None), users.c.id.not_in(select(rollups.c.user_id)))))
+
+    checkpoint.last_id = 1
+    db.session.commit()
+
+
+# Add the login events after the checkpoint to the per user and per day rollups, batch_size events per transaction.
+# Each batch moves the checkpoint forward in the same transaction as its rollups, and the checkpoint stays locked
+# until then, so a batch is never counted twice. Returns the number of events aggregated.
+def aggregate_logins(batch_size=10000):
+    backfill_login_rollups()
+
+    aggregated = 0
+    while True:
+        checkpoint = lock_checkpoint(CHECKPOINT)
+
+        events = db.session.execute(select(LoginEvent.id, LoginEvent.user_id, LoginEvent.logged_in_on, LoginEvent.ip)
+                                    .where(LoginEvent.id > checkpoint.last_id)
+                                    .order_by(LoginEvent.id)
+                                    .limit(batch_size)).all()
+        if not events:
+            db.session.commit()
+            return aggregated
+
+        # Load only the rollups this batch changes
+        user_ids = {event.user_id for event in events}
+        rollups = {rollup.user_id: rollup for rollup in
+                   UserLoginRollup.query.filter(UserLoginRollup.user_id.in_(user_ids)).populate_existing()}
+        days = Counter()
+
+        # Events are in id order, so each user's latest login is applied last
+        for event in events:
+            rollup = rollups.get(event.user_id)
+            if rollup is None:
+                rollup = rollups[event.user_id] = UserLoginRollup(user_id=event.user_id, total_no_logins=0)
+                db.session.add(rollup)
+
+            rollup.last_login, rollup.last_ip = rollup.current_login, rollup.current_ip
+            rollup.current_login, rollup.current_ip = event.logged_in_on, event.ip
+            rollup.total_no_logins += 1
+            days[event.logged_in_on.date()] += 1
+
+        for day, logins in days.items():
+            daily = db.session.get(DailyLoginRollup, day)
+            if daily is None:
+                daily = DailyLoginRollup(day=day, total_no_logins=0)
+                db.session.add(daily)
+            daily.total_no_logins += logins
+
+        checkpoint.last_id = events[-1].id
+        db.session.commit()
+        aggregated += len(events)
+
+
+# Scheduled aggregation, e.g. every minute: flask --app app aggregate-logins
+# or as a background worker: flask --app app aggregate-logins --every 60
+@app.cli.command('aggregate-logins')
+@click.option('--batch-size', type=int, default=10000, help='Login events aggregated per transaction.')
+@click.option('--every', type=float, help='Keep running, aggregating new logins every this many seconds.')
+def aggregate_logins_command(batch_size, every):
+    while True:
+        click.echo('%d logins aggregated' % aggregate_logins(batch_size))
+        if not every:
+            return
+        time.sleep(every)
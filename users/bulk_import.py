@@ -0,0 +1,150 @@
+# IMPORTS
+import csv
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+import bcrypt
+import click
+import pyotp
+from cryptography.fernet import Fernet
+from sqlalchemy import insert
+from werkzeug.datastructures import MultiDict
+
+from app import app, db
+from models import User, provisioning_uri
+from users.forms import RegisterForm
+
+# CONFIG
+IMPORT_FIELDS = ('email', 'firstname', 'lastname', 'phone', 'date_of_birth', 'postcode', 'password')
+
+
+# Read user rows one at a time from a CSV file (with a header row) or a JSON lines file.
+# Yields (line number, row) so errors can be reported against the input file.
+def read_rows(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            # Line 1 is the header row
+            for line_number, row in enumerate(csv.DictReader(f), 2):
+                yield line_number, row
+        else:
+            for line_number, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        yield line_number, json.loads(line)
+                    except json.JSONDecodeError:
+                        yield line_number, None
+
+
+# Validate a row with the same rules as the registration page.
+# Returns a list of error messages, empty if the row is valid.
+def validate_row(row):
+    if not isinstance(row, dict):
+        return ['Row is not a JSON object']
+
+    data = MultiDict({field: str(row.get(field) or '') for field in IMPORT_FIELDS})
+    # Imported rows have no confirmation field, the password is confirmed as given
+    data['confirm_password'] = data['password']
+
+    form = RegisterForm(formdata=data, meta={'csrf': False})
+    if form.validate():
+        return []
+    return ['%s: %s' % (field, message) for field, messages in form.errors.items() for message in messages]
+
+
+# bcrypt releases the GIL while hashing, so a thread pool hashes passwords in parallel
+def hash_password(password):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+
+
+# Import users from path in batches of batch_size rows, one transaction per batch.
+# Imported users never see the registration page's 2FA QR code, so the email and 2FA provisioning URI of each
+# created user are written to the csv writer enrolments, to be sent to the user.
+# Returns the number of users created and a list of (line number, error) for every rejected row.
+def import_users(path, enrolments, batch_size=500, workers=None):
+    created, errors = 0, []
+    seen_emails = set()
+    rows = read_rows(path)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor, app.test_request_context():
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+
+            # Validate each row, rejecting emails repeated within the file
+            valid = []
+            for line_number, row in batch:
+                row_errors = validate_row(row)
+                if not row_errors and row['email'] in seen_emails:
+                    row_errors = ['email: Email address appears more than once in the file']
+                if row_errors:
+                    errors.extend((line_number, error) for error in row_errors)
+                    continue
+                seen_emails.add(row['email'])
+                valid.append((line_number, row))
+
+            # Reject emails that are already registered, with one query per batch
+            existing = {email for email, in db.session.query(User.email)
+                        .filter(User.email.in_([row['email'] for _, row in valid]))}
+            for line_number, row in valid:
+                if row['email'] in existing:
+                    errors.append((line_number, 'email: Email address already exists'))
+            valid = [(line_number, row) for line_number, row in valid if row['email'] not in existing]
+
+            if not valid:
+                continue
+
+            passwords = executor.map(hash_password, [row['password'] for _, row in valid])
+            registered_on = datetime.now()
+
+            # Each user gets their own 2FA secret and draw encryption key, as User() would create
+            pin_keys = [pyotp.random_base32() for _ in valid]
+            db.session.execute(insert(User), [{'email': row['email'],
+                                               'firstname': row['firstname'],
+                                               'lastname': row['lastname'],
+                                               'phone': row['phone'],
+                                               'date_of_birth': row['date_of_birth'],
+                                               'postcode': row['postcode'],
+                                               'password': password,
+                                               'role': 'user',
+                                               'pin_key': pin_key,
+                                               'draws_key': Fernet.generate_key(),
+                                               'registered_on': registered_on}
+                                              for (_, row), password, pin_key in zip(valid, passwords, pin_keys)])
+            db.session.commit()
+            enrolments.writerows((row['email'], provisioning_uri(pin_key, row['email']))
+                                 for (_, row), pin_key in zip(valid, pin_keys))
+            created += len(valid)
+
+    # Log the import in lottery.log file
+    logging.warning('SECURITY - Bulk user import [%s, %s users]', os.path.basename(path), created)
+    return created, errors
+
+
+# Command line import, e.g. flask --app app import-users partners.csv --enrolments partners_2fa.csv
+@app.cli.command('import-users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--enrolments', type=click.Path(dir_okay=False), required=True,
+              help='New CSV file for the email and 2FA provisioning URI of each imported user.')
+@click.option('--batch-size', type=int, default=500, help='Rows inserted per transaction.')
+@click.option('--workers', type=int, help='Password hashing threads, defaults to the number of CPUs.')
+def import_users_command(path, enrolments, batch_size, workers):
+    # The provisioning URIs are the users' 2FA secrets, so the file must be new and only readable by its owner
+    try:
+        descriptor = os.open(enrolments, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        raise click.BadParameter('%s already exists' % enrolments, param_hint='--enrolments')
+
+    with open(descriptor, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(('email', 'provisioning_uri'))
+        created, errors = import_users(path, writer, batch_size, workers)
+
+    for line_number, error in errors:
+        click.echo('line %d: %s' % (line_number, error), err=True)
+    click.echo('%d users imported, %d errors' % (created, len(errors)))
+    click.echo('2FA provisioning URIs written to %s, send each to its user and delete the file' % enrolments)
@@ -1,6 +1,4 @@
 # IMPORTS
-from datetime import datetime
-
 import bcrypt
 from flask import Blueprint, render_template, flash, redirect, url_for, session, request
 from flask_login import login_user, logout_user, current_user, login_required
@@ -8,6 +6,7 @@ from markupsafe import Markup
 
 from app import db
 from models import User
+from users.activity import record_login
 from users.forms import RegisterForm, LoginForm, PasswordForm
 import logging
 
@@ -138,8 +137,6 @@ def login():
             # If all validations pass, log the user in and store their session
             login_user(user)
 
-            # Increment the user's total login count
-            current_user.total_no_logins += 1
             # Log the successful user login in lottery.log file
             logging.warning('SECURITY - Log in [%s, %s, %s]',
                             current_user.id,
@@ -147,14 +144,8 @@ def login():
                             request.remote_addr
                             )
 
-            # Update the current user's details
-            current_user.current_login = datetime.now()
-            current_user.last_login = current_user.current_login
-            current_user.current_ip = request.remote_addr
-            current_user.last_ip = current_user.current_ip
-
-            # Commit changes to the database
-            db.session.commit()
+            # Append the login to the activity log, the user activity page reads it once aggregate-logins has run
+            record_login(current_user.id, request.remote_addr)
 
             # Redirect the user to the appropriate page based on their role (user or admin)
             if current_user.role == 'user':